@@ -0,0 +1,177 @@
+"""
+ActivityRecorder class
+
+Streams the activity of the retina's layers to disk while the model runs, so
+that a long run does not need to hold every activity in memory.  Each recorded
+layer collects its activities in a small preallocated chunk of
+(chunk_size x number_values) which is appended to a raw binary file whenever it
+fills up, so the memory used stays constant however long the model runs.
+
+    layer_names - the names of the layers whose activities are written to disk
+                  (None records all layers)
+    decimation - only every decimation-th activity of a layer is written, so
+                 the recorded activities are indexed by recorded step, where
+                 recorded step t is the (t * decimation)-th update of the layer
+
+The running min/max activity of every layer that is passed to the recorder is
+kept as it runs (over all timesteps, not just the written ones), so the
+activity bounds are known without reading the recordings back.
+
+An index of the recordings (sizes, bounds and data type) is written to
+recording.p when the recorder is flushed, so loadRecordedActivities can reopen
+the recorded activities as memory-maps.
+"""
+
+import os
+import pickle
+import numpy as np
+
+class ActivityRecorder(object):
+
+    def __init__(self, directory, layer_names=None, decimation=1, chunk_size=64,
+                 dtype=np.float64):
+        self.directory      = directory
+        self.layer_names    = layer_names
+        self.decimation     = decimation
+        self.chunk_size     = chunk_size
+        self.dtype          = np.dtype(dtype)
+        self.recordings     = {}
+
+        if not(os.path.exists(self.directory)):
+            os.makedirs(self.directory)
+
+    def isRecording(self, layer_name):
+        return self.layer_names == None or layer_name in self.layer_names
+
+    """
+    Record the (1 x number_values) activity of a layer for one timestep
+    """
+    def record(self, layer_name, activity):
+        if layer_name not in self.recordings:
+            path = os.path.join(self.directory, layer_name + ".bin")
+            self.recordings[layer_name] = LayerRecording(path, np.size(activity),
+                                                         self.isRecording(layer_name),
+                                                         self.decimation, self.chunk_size,
+                                                         self.dtype)
+        self.recordings[layer_name].record(activity)
+
+    """
+    Get the running [min, max] activity of a layer
+    """
+    def getBounds(self, layer_name):
+        recording = self.recordings[layer_name]
+        return [recording.min_activity, recording.max_activity]
+
+    """
+    Get the written activities of a layer as a read-only memory-map of size
+    (steps x 1 x number_values), so activities[t] is the (1 x number_values)
+    activity of recorded step t just like the in-memory activity lists (with
+    decimation, that is the activity of timestep t * decimation)
+    """
+    def getActivities(self, layer_name):
+        if layer_name not in self.recordings: return None
+        return self.recordings[layer_name].getActivities()
+
+    """
+    Write any partially filled chunks and the index of the recordings
+    """
+    def flush(self):
+        index = {}
+        for layer_name, recording in self.recordings.iteritems():
+            recording.flush()
+            if recording.record_to_disk:
+                index[layer_name] = {"path"             : os.path.basename(recording.path),
+                                     "number_values"    : recording.number_values,
+                                     "number_steps"     : recording.number_steps,
+                                     "decimation"       : recording.decimation,
+                                     "dtype"            : recording.dtype.str,
+                                     "bounds"           : [recording.min_activity, recording.max_activity]}
+
+        fh = open(os.path.join(self.directory, "recording.p"), "wb")
+        pickle.dump(index, fh)
+        fh.close()
+
+
+
+"""
+The recording of a single layer.  Activities are counted as they arrive, but
+only every decimation-th one is copied into the chunk.
+"""
+class LayerRecording(object):
+
+    def __init__(self, path, number_values, record_to_disk, decimation, chunk_size, dtype):
+        self.path           = path
+        self.number_values  = number_values
+        self.record_to_disk = record_to_disk
+        self.decimation     = decimation
+        self.dtype          = dtype
+
+        self.number_updates = 0
+        self.number_steps   = 0
+        self.min_activity   = np.inf
+        self.max_activity   = -np.inf
+
+        self.chunk          = None
+        self.chunk_steps    = 0
+        self.activities     = None
+        if self.record_to_disk:
+            self.chunk = np.zeros((chunk_size, number_values), dtype=dtype)
+            open(self.path, "wb").close()
+
+    def record(self, activity):
+        self.min_activity = min(self.min_activity, np.amin(activity))
+        self.max_activity = max(self.max_activity, np.amax(activity))
+
+        write_step = self.record_to_disk and self.number_updates % self.decimation == 0
+        self.number_updates += 1
+        if not(write_step): return
+
+        self.chunk[self.chunk_steps] = np.reshape(activity, self.number_values)
+        self.chunk_steps    += 1
+        self.number_steps   += 1
+        if self.chunk_steps == len(self.chunk): self.flush()
+
+    def flush(self):
+        if self.chunk_steps == 0: return
+        fh = open(self.path, "ab")
+        self.chunk[:self.chunk_steps].tofile(fh)
+        fh.close()
+        self.chunk_steps = 0
+
+    """
+    The memory-map is kept and only reopened once more activities have been
+    written
+    """
+    def getActivities(self):
+        if not(self.record_to_disk): return None
+        self.flush()
+        if self.activities is None or len(self.activities) != self.number_steps:
+            self.activities = openActivities(self.path, self.dtype, self.number_steps, self.number_values)
+        return self.activities
+
+
+
+"""
+Open a raw binary recording of number_steps activities as a read-only
+(number_steps x 1 x number_values) memory-map
+"""
+def openActivities(path, dtype, number_steps, number_values):
+    if number_steps == 0: return np.zeros((0, 1, number_values), dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=(number_steps, 1, number_values))
+
+"""
+Reopen the activities written by an ActivityRecorder to directory.  Returns a
+dictionary mapping each recorded layer's name to [activities, bounds].
+"""
+def loadRecordedActivities(directory):
+    fh      = open(os.path.join(directory, "recording.p"), "rb")
+    index   = pickle.load(fh)
+    fh.close()
+
+    recorded_activities = {}
+    for layer_name, info in index.iteritems():
+        path        = os.path.join(directory, info["path"])
+        activities  = openActivities(path, np.dtype(info["dtype"]), info["number_steps"],
+                                     info["number_values"])
+        recorded_activities[layer_name] = [activities, info["bounds"]]
+    return recorded_activities
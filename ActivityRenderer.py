@@ -0,0 +1,164 @@
+"""
+ActivityRenderer class
+
+Renders the recorded activities of a retina's layers to disk without a display.
+Each layer is rasterized once into a label image (see Rasterize.py), and only
+the pixels covered by a cell are kept along with the index of the cell that
+covers them.  A frame is then drawn by looking up the colors of the layer's
+activities in the colormap's table and copying them into those pixels of a
+numpy image, so no pygame drawing is done per cell or per frame.
+
+The renderer only holds the rasterized geometry and the color table (not the
+retina), so it can be sent to worker processes and the frames of a run can be
+rendered in parallel.
+
+    layer_names - the names of the layers that will be rendered (None renders
+                  all of the retina's layers)
+    scale - the number of pixels per grid unit, like the scale passed to
+            drawLayerActivity
+    image_format - "png" writes a numbered image per frame into a directory
+                   named after the layer, "raw" writes all of the frames into
+                   a single <layer name>.rgb file of packed (height x width x 3)
+                   uint8 frames that can be fed to a video encoder (e.g. ffmpeg
+                   -f rawvideo -pix_fmt rgb24 -s <width>x<height>)
+"""
+
+import os
+from multiprocessing import Pool
+from Constants import *
+
+
+class ActivityRenderer(object):
+
+    def __init__(self, retina, layer_names=None, scale=1.0, colormap=BLUE_RED_COLORMAP,
+                 background_color=(255,255,255), number_colors=1024):
+        if layer_names == None:
+            layer_names = [retina.layer_names[i] for i in range(retina.number_layers)
+                           if retina.layers[i] != None]
+
+        self.scale              = scale
+        self.width              = int(np.ceil(retina.grid_width * scale))
+        self.height             = int(np.ceil(retina.grid_height * scale))
+        self.background_color   = np.array(background_color, dtype=np.uint8)
+        self.colormap_lut       = getColormapLUT(colormap, number_colors)
+
+        # For each layer, the flat indices of the pixels covered by a cell and
+        # the column of the layer's activities that colors each pixel
+        self.layer_names    = layer_names
+        self.pixels         = {}
+        self.pixel_labels   = {}
+        for layer_name in layer_names:
+            layer               = retina.layers[retina.layer_names.index(layer_name)]
+            label_image         = layer.buildLabelImage(self.width, self.height, scale=scale).ravel()
+            pixels              = np.flatnonzero(label_image >= 0)
+            self.pixels[layer_name]         = pixels
+            self.pixel_labels[layer_name]   = label_image[pixels]
+
+    """
+    Render one (1 x number_values) activity of a layer into a (height x width
+    x 3) uint8 image.  If an image is passed in, it is drawn into and reused.
+    """
+    def renderFrame(self, layer_name, activity, image=None):
+        if image is None:
+            image = np.zeros((self.height, self.width, 3), dtype=np.uint8)
+        image[:, :] = self.background_color
+        colors = self.colormap_lut.getColors(np.reshape(activity, -1))
+        image.reshape(-1, 3)[self.pixels[layer_name]] = colors[self.pixel_labels[layer_name]]
+        return image
+
+    """
+    Render a (steps x 1 x number_values) array of a layer's activities (e.g.
+    the layer's activity list, or a memory-map from a snapshot or a recording)
+    into directory.  The frames are split into tasks of frames_per_task and,
+    if number_processes > 1, the tasks are spread over a pool of workers.  A
+    task is only the range of frames it renders, and the activities of the
+    range are read when the task is run, so a memory-mapped run is never read
+    into memory all at once.  Returns the path of the rendered frames.
+    """
+    def renderActivities(self, layer_name, activities, directory, image_format="png",
+                         number_processes=1, frames_per_task=64):
+        number_frames = len(activities)
+        if image_format == "png":
+            path = os.path.join(directory, layer_name)
+            if not(os.path.exists(path)): os.makedirs(path)
+        elif image_format == "raw":
+            path = os.path.join(directory, layer_name + ".rgb")
+            if not(os.path.exists(directory)): os.makedirs(directory)
+            # Size the file up front so each task can write its frames in place
+            fh = open(path, "wb")
+            fh.truncate(number_frames * self.height * self.width * 3)
+            fh.close()
+        else:
+            raise ValueError("Unknown image format: {0}".format(image_format))
+
+        tasks = []
+        for start in range(0, number_frames, frames_per_task):
+            stop = min(start + frames_per_task, number_frames)
+            tasks.append([layer_name, start, stop, path, image_format])
+
+        if number_processes > 1:
+            pool = Pool(number_processes, initializer=initializeRenderWorker, 
+                        initargs=(self, activities))
+            pool.map(renderFramesTask, tasks)
+            pool.close()
+            pool.join()
+        else:
+            for layer_name, start, stop, path, image_format in tasks:
+                self.renderFrames(layer_name, activities, start, stop, path, image_format)
+        return path
+
+    """
+    Render frames start through stop - 1 of a layer's activities
+    """
+    def renderFrames(self, layer_name, activities, start, stop, path, image_format):
+        activities  = np.asarray(activities[start:stop])
+        image       = np.zeros((self.height, self.width, 3), dtype=np.uint8)
+        if image_format == "png":
+            for frame_index in range(len(activities)):
+                self.renderFrame(layer_name, activities[frame_index], image)
+                # Surfaces are indexed (x, y) while images are indexed (y, x)
+                surface     = pygame.surfarray.make_surface(image.transpose(1, 0, 2))
+                filename    = "frame_{0:05d}.png".format(start + frame_index)
+                pygame.image.save(surface, os.path.join(path, filename))
+        else:
+            fh = open(path, "r+b")
+            fh.seek(start * image.nbytes)
+            for frame_index in range(len(activities)):
+                self.renderFrame(layer_name, activities[frame_index], image)
+                fh.write(image.tobytes())
+            fh.close()
+
+
+
+"""
+Each worker gets the renderer and the activities being rendered once, when the
+pool is started, rather than with every task (the workers are forked, so the
+activities, e.g. a memory-map, are shared rather than copied)
+"""
+WORKER_RENDERER     = None
+WORKER_ACTIVITIES   = None
+
+def initializeRenderWorker(renderer, activities):
+    global WORKER_RENDERER, WORKER_ACTIVITIES
+    WORKER_RENDERER     = renderer
+    WORKER_ACTIVITIES   = activities
+
+def renderFramesTask(task):
+    layer_name, start, stop, path, image_format = task
+    WORKER_RENDERER.renderFrames(layer_name, WORKER_ACTIVITIES, start, stop, path, image_format)
+
+
+"""
+Render the recorded activities of every layer in layer_names (None renders all
+of the retina's layers that have activities) into directory in one pass
+"""
+def renderRetina(retina, directory, layer_names=None, scale=1.0, colormap=BLUE_RED_COLORMAP,
+                 image_format="png", number_processes=1, frames_per_task=64):
+    renderer = ActivityRenderer(retina, layer_names, scale, colormap)
+    paths    = {}
+    for layer_name in renderer.layer_names:
+        activities = retina.getLayerActivities(retina.layer_names.index(layer_name))
+        if activities is None or len(activities) == 0: continue
+        paths[layer_name] = renderer.renderActivities(layer_name, activities, directory, image_format,
+                                                      number_processes, frames_per_task)
+    return paths
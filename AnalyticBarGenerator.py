@@ -0,0 +1,109 @@
+import numpy as np
+from RuntimeBarGenerator import RuntimeBarGenerator
+
+
+
+"""
+The AnalyticBarGenerator class creates the same moving bar stimulus as the
+RuntimeBarGenerator without pygame.  Instead of drawing the bar to a display and
+reading the pixels back, the bar (defined by bar_vertices) is evaluated directly
+into a float32 array of intensities, so it can be run headless.
+
+The intensity of a color is the average of its (R,G,B) values divided by 255,
+just like the intensities read from the pygame display.
+
+Inputs:
+    Same as RuntimeBarGenerator plus
+    subpixel_samples - each pixel is sampled on a (n x n) grid centered on the
+                       pixel's position and its intensity is mixed between the
+                       bar and background intensities by the fraction of samples
+                       within the bar; 1 samples only the pixel's position,
+                       which gives hard edges like pygame
+
+Methods:
+    update(deltaTime) - this will update the frame if necessary
+"""
+class AnalyticBarGenerator(RuntimeBarGenerator):
+
+    def __init__(self, framerate=30.0, movie_size=(800,800),
+                 background_color=(255,255,255), bar_orientation=45.0,
+                 bar_size=(20.0,60.0), bar_speed=20.0, bar_movement_distance=500.0,
+                 bar_color=(0,0,0), bar_position=(100,100), subpixel_samples=1):
+
+        self.subpixel_samples = subpixel_samples
+        RuntimeBarGenerator.__init__(self, framerate=framerate, movie_size=movie_size,
+                                     background_color=background_color,
+                                     bar_orientation=bar_orientation, bar_size=bar_size,
+                                     bar_speed=bar_speed,
+                                     bar_movement_distance=bar_movement_distance,
+                                     bar_color=bar_color, bar_position=bar_position)
+
+    def __str__(self):
+        string = RuntimeBarGenerator.__str__(self)
+        string += "\nSubpixel Samples\t\t\t"+str(self.subpixel_samples)
+        return string
+
+    """
+    There is no display - the screen is just the (width x height) intensity array
+    """
+    def initializeScreen(self):
+        self.display                = None
+        self.bar_intensity          = np.average(self.bar_color) / 255.0
+        self.background_intensity   = np.average(self.background_color) / 255.0
+        self.screen_array           = np.zeros((self.movie_width, self.movie_height), dtype=np.float32)
+
+        # Offsets of the samples within a pixel (along one axis)
+        n                   = self.subpixel_samples
+        self.sample_offsets = (np.arange(n) + 0.5) / n - 0.5
+
+    def drawBar(self):
+        pass
+
+    """
+    Evaluate the bar into the intensity array.  Only the pixels within the
+    bounding box of the bar need to be tested.
+    """
+    def updateScreenArray(self):
+        self.screen_array.fill(self.background_intensity)
+
+        coverage, left, up = self.calculateBarCoverage()
+        if coverage is None: return
+
+        width, height = coverage.shape
+        self.screen_array[left:left+width, up:up+height] += coverage * (self.bar_intensity - self.background_intensity)
+
+    """
+    Find the fraction of each pixel's samples that are within the bar for the
+    pixels around the bar.  Returns the (w x h) coverage array and the pixel
+    position of its upper left corner (or None if the bar is off screen).
+    """
+    def calculateBarCoverage(self):
+        vertices = np.array(self.bar_vertices, dtype=float)
+        n        = self.subpixel_samples
+
+        # Pixels whose samples could fall within the bar
+        left    = max(int(np.floor(np.min(vertices[:, 0]))) - 1, 0)
+        right   = min(int(np.ceil(np.max(vertices[:, 0]))) + 1, self.movie_width - 1)
+        up      = max(int(np.floor(np.min(vertices[:, 1]))) - 1, 0)
+        down    = min(int(np.ceil(np.max(vertices[:, 1]))) + 1, self.movie_height - 1)
+        if left > right or up > down: return None, 0, 0
+
+        sample_xs = (np.arange(left, right+1).reshape(-1, 1) + self.sample_offsets).reshape(-1, 1)
+        sample_ys = (np.arange(up, down+1).reshape(-1, 1) + self.sample_offsets).reshape(1, -1)
+
+        # A sample is within the (convex) bar if it is on the inner side of
+        # every edge.  The inner side depends on the winding of the vertices,
+        # which is given by the sign of the polygon's area.
+        next_vertices   = np.roll(vertices, -1, 0)
+        winding         = np.sign(np.sum(vertices[:, 0] * next_vertices[:, 1] - next_vertices[:, 0] * vertices[:, 1]))
+
+        inside = np.ones((len(sample_xs), sample_ys.shape[1]), dtype=bool)
+        for (x1, y1), (x2, y2) in zip(vertices, next_vertices):
+            cross   = (x2 - x1) * (sample_ys - y1) - (y2 - y1) * (sample_xs - x1)
+            inside &= winding * cross >= 0
+
+        # Average the samples of each pixel
+        width       = right - left + 1
+        height      = down - up + 1
+        coverage    = inside.reshape(width, n, height, n).mean(axis=3).mean(axis=1)
+        return coverage, left, up
@@ -1,5 +1,7 @@
 import math as m
-from RuntimeBarGenerator import RuntimeBarGenerator
+import numpy as np
+from AnalyticBarGenerator import AnalyticBarGenerator
+from PrecomputedBarMovie import PrecomputedBarMovie
 
 
 
@@ -7,7 +9,10 @@ from RuntimeBarGenerator import RuntimeBarGenerator
 class BarStimulus:
 
     def __init__(self, position_on_retina=(0.0, 0.0), pixel_size=1.0, 
-                 bar_movie=RuntimeBarGenerator()):
+                 bar_movie=None):
+
+        # The default movie is evaluated with numpy, so no display is opened
+        if bar_movie == None: bar_movie = AnalyticBarGenerator()
 
         self.position_on_retina     = position_on_retina
         self.pixel_size             = pixel_size
@@ -48,6 +53,32 @@ class BarStimulus:
     def update(self, timestep):
         self.bar_movie.update(timestep)
     
+    """
+    Whether all of the frames of the bar_movie have been rendered ahead of time
+    """
+    def hasPrecomputedFrames(self):
+        return isinstance(self.bar_movie, PrecomputedBarMovie)
+    
+    def getNumberFrames(self):
+        return self.bar_movie.number_frames
+    
+    """
+    Get the index of the frame currently shown by the bar_movie
+    """
+    def getFrameIndex(self):
+        if self.hasPrecomputedFrames():
+            return min(self.bar_movie.frame, self.bar_movie.number_frames-1)
+        return self.bar_movie.frame
+    
+    """
+    Get the intensities of frames [start, end) of a precomputed bar_movie as a
+    (frames x (width*height)) array, with pixels ordered as in
+    getPixelIntensities
+    """
+    def getFramePixelIntensities(self, start, end):
+        frames = self.bar_movie.frames[start:end]
+        return frames.reshape(len(frames), self.width_in_pixels * self.height_in_pixels)
+    
     """
     Get the intensity of a pixel with name pixel_ID from the bar_movie
     """
@@ -56,6 +87,22 @@ class BarStimulus:
         x, y = int(x), int(y)
         intensity = self.bar_movie.screen_array[x, y]
         return intensity
+    
+    """
+    Convert a pixel_ID, "x.y", into the index of that pixel within the 
+    flattened (width*height) intensity array returned by getPixelIntensities
+    """
+    def getPixelNumber(self, pixel_ID):
+        x, y = pixel_ID.split(".")
+        x, y = int(x), int(y)
+        return x * self.height_in_pixels + y
+    
+    """
+    Get the intensities of all pixels from the bar_movie as a flattened array
+    of length (width*height) where pixel (x, y) is at index x*height + y
+    """
+    def getPixelIntensities(self):
+        return np.ravel(self.bar_movie.screen_array)
 
     """
     Given a cone's bounding box, [L, R, U, D], find the overlapping pixels on
@@ -4,29 +4,36 @@ from Constants import *
 
 class Bipolar:
     
-    def __init__(self, layer, location):
+    def __init__(self, layer, location, index):
         self.location = location
+        self.index    = index
         
         self.layer  = layer
         self.retina = layer.retina
         
         self.history_size   = layer.history_size           
-        
-        self.activities = []
-        self.neurotransmitter_ouputs = []
-        for step in range(self.history_size):
-            self.activities.append([0.0])
-            self.neurotransmitter_ouputs.append([{}])
             
         self.inputs = []
     
-    def loadPast(self, activity):
-        self.activities[0] = activity
+    """
+    The activity and neurotransmitter history of bipolar cells is stored by the
+    layer in per-layer arrays, so this reads this neuron's entry from them
+    """
+    def getNeurotransmitterOutputs(self, history_index, compartment_index):
+        layer_nt_outputs    = self.layer.getNeurotransmitterOutputs(history_index)
+        nt_outputs          = {}
+        for nt, nt_amounts in layer_nt_outputs.iteritems():
+            nt_outputs[nt] = nt_amounts[0, self.index]
+        return nt_outputs
     
-    def drawActivity(self, surface, radius, colormap, activity_bounds, scale=1.0):
-        min_activity, max_activity = activity_bounds  
-        activity = self.activities[0]
-        color = getColorFromActivity(colormap, activity) 
+    """
+    Draw the bipolar in the color of its current activity (unless a color is
+    given)
+    """
+    def drawActivity(self, surface, radius, colormap, activity_bounds, scale=1.0, color=None):
+        if color == None:
+            activity    = self.layer.activities[0][0, self.index]
+            color       = getColormapLUT(colormap).getColors(activity).tolist()
         location = (self.location * scale).toIntTuple()
         pygame.draw.circle(surface, color, location, radius)      
         
@@ -35,53 +42,23 @@ class Bipolar:
         radius = int(radius * scale)
         pygame.draw.circle(surface, color, location, radius)
         
-    def update(self, cone_activities, horizontal_activities):
-        # Delete the oldest history
-        del self.activities[-1]
-        del self.neurotransmitter_ouputs[-1]
-        
-        # Update the internal activity
-        new_activity = 0
-        for triad_ID, triad_weight in self.inputs:
-            triad_number            = self.layer.triad_locations[triad_ID]
-            cone_activity           = cone_activities[0, triad_number]
-            horizontal_activity     = horizontal_activities[0, triad_number]
-            
-            if self.layer.bipolar_type == "On":
-#                triad_activity = -cone_activity 
-                triad_activity = -(cone_activity - horizontal_activity)/2.0  
-            else: 
-#                triad_activity = cone_activity
-                triad_activity = (cone_activity - horizontal_activity)/2.0
-            
-            new_activity += triad_weight * triad_activity
-        
-        # Update the neurotransmitter amounts that are output
-        new_neurotransmitter_outputs = self.compartments[0].calculateNeurotransmitterOutputsFromPotential(self, new_activity)
-        
-        # Store the new activity and nt output
-        self.activities.insert(0, [new_activity])
-        self.neurotransmitter_ouputs.insert(0, [new_neurotransmitter_outputs])
-        
-        return new_activity
-        
     def compartmentalize(self, compartment):
         self.compartments = [compartment]
         compartment_index = 0
         compartment.registerWithRetina(self, compartment_index)
         
-    def establishInputs(self):
-        radius = self.layer.input_field_radius_gridded
-        
+    """
+    Connect the bipolar to the triads (found by the layer) that lie within its
+    input field.  Each triad is weighted equally.
+    """
+    def establishInputs(self, triad_numbers):
         weight_sum = 0.0
         connected_triads = []
-        for triad_ID in self.layer.triad_locations:                
-            triad_x, triad_y = map(float, triad_ID.split('.'))
-            triad_position = Vector2D(triad_x, triad_y)
-            if self.location.distanceTo(triad_position) < radius:
-                triad_weight = 1.0               
-                connected_triads.append([triad_ID, triad_weight])
-                weight_sum += triad_weight
+        for triad_number in triad_numbers:
+            triad_ID        = self.layer.triad_IDs[triad_number]
+            triad_weight    = 1.0               
+            connected_triads.append([triad_ID, triad_weight])
+            weight_sum += triad_weight
         
         # Normalize the sum of the weights to 1
         self.inputs = [[triad_ID, triad_weight/weight_sum] for triad_ID, triad_weight in connected_triads]
@@ -1,12 +1,12 @@
-import random
-import math as m
+from scipy import sparse
+from scipy.spatial import cKDTree
 from Constants import *
 
 class BipolarLayer:
     
     def __init__(self, retina, bipolar_type, cone_layer, horizontal_layer, history_size,
                  input_delay, layer_depth, nearest_neighbor_distance, minimum_required_density,
-                 input_field_radius, output_field_radius):
+                 input_field_radius, output_field_radius, locations=None, input_weights=None):
                      
         self.retina             = retina
         self.cone_layer         = cone_layer
@@ -29,11 +29,15 @@ class BipolarLayer:
         self.output_field_radius            = output_field_radius
         self.output_field_radius_gridded    = output_field_radius / retina.grid_size
                 
-        self.placeNeurons()
+        # The locations can be given (e.g. by a saved snapshot) instead of 
+        # placing the neurons
+        if locations == None:   self.placeNeurons()
+        else:                   self.locations = locations
         self.number_neurons = len(self.locations)
         self.neurons = []
-        for location in self.locations:
-            neuron = Bipolar(self, Vector2D(location[0], location[1]))            
+        for neuron_index in range(self.number_neurons):
+            location = self.locations[neuron_index]
+            neuron = Bipolar(self, Vector2D(location[0], location[1]), neuron_index)
             self.neurons.append(neuron)
         
         self.calculateReceptiveFieldPoints()
@@ -41,18 +45,99 @@ class BipolarLayer:
         
         # Hack to keep the structure of IDs = "x.y" (current visualization needs IDs of this structure)
         self.triad_locations = {}
+        self.triad_IDs = []
         self.number_triads = len(self.cone_layer.locations)        
         for triad_number in range(self.number_triads):                
             triad_x, triad_y    = self.cone_layer.locations[triad_number]
             triad_ID            = str(triad_x)+"."+str(triad_y)
             self.triad_locations[triad_ID] = triad_number 
+            self.triad_IDs.append(triad_ID)
         
         self.compartmentalize()
-        self.establishInputs()
+        
+        # The input weights can be given (e.g. by a saved snapshot) instead of
+        # finding the triads within each input field
+        if input_weights is None:   self.establishInputs()
+        else:                       self.loadInputs(input_weights)
+        
+        self.initializeActivities()
+        self.label_image_cache = LabelImageCache()
     
+    """
+    Establish the inputs of each neuron and then compile them into a sparse
+    (bipolars x triads) weight matrix so that the layer can be updated at once.
+    The triads within each bipolar's input field are found with a single 
+    batched KD-tree query over the triad locations.
+    """
     def establishInputs(self):
+        radius          = self.input_field_radius_gridded
+        triad_points    = np.array(self.cone_layer.locations, dtype=float)
+        bipolar_points  = np.array(self.locations, dtype=float)
+        
+        # The query includes triads at exactly the radius, but inputs must be
+        # strictly within the radius, so the distances are checked afterwards
+        tree                = cKDTree(triad_points)
+        nearby_triad_lists  = tree.query_ball_point(bipolar_points, radius)
+        
+        neuron_numbers  = []
+        triad_numbers   = []
+        triad_weights   = []
+        for neuron in self.neurons:
+            nearby_triads   = np.array(nearby_triad_lists[neuron.index], dtype=int)
+            offsets         = triad_points[nearby_triads] - bipolar_points[neuron.index]
+            distances       = np.sqrt(np.sum(offsets**2.0, 1))
+            neuron.establishInputs(nearby_triads[distances < radius])
+            
+            for triad_ID, triad_weight in neuron.inputs:
+                neuron_numbers.append(neuron.index)
+                triad_numbers.append(self.triad_locations[triad_ID])
+                triad_weights.append(triad_weight)
+                
+        self.input_weights = sparse.csr_matrix((triad_weights, (neuron_numbers, triad_numbers)),
+                                               shape=(self.number_neurons, self.number_triads))
+    
+    """
+    Use a (bipolars x triads) sparse weight matrix, like the one compiled by
+    establishInputs, and set the inputs of each neuron from its row
+    """
+    def loadInputs(self, input_weights):
+        self.input_weights  = sparse.csr_matrix(input_weights)
+        indptr              = self.input_weights.indptr
         for neuron in self.neurons:
-            neuron.establishInputs()
+            start, stop     = indptr[neuron.index], indptr[neuron.index + 1]
+            triad_numbers   = self.input_weights.indices[start:stop].tolist()
+            triad_weights   = self.input_weights.data[start:stop].tolist()
+            neuron.inputs   = [[self.triad_IDs[triad_number], triad_weight] 
+                               for triad_number, triad_weight in zip(triad_numbers, triad_weights)]
+    
+    """
+    Initialize a zero-filled history of activities and neurotransmitter outputs.
+    The outputs of every neurotransmitter are stored side by side in one
+    history and neurotransmitter_outputs holds a view of each one's columns.
+    """
+    def initializeActivities(self):
+        self.activities = HistoryBuffer(self.history_size, self.number_neurons)
+        
+        output_nts                      = sorted(self.compartment.neurotransmitters_output_weights)
+        self.neurotransmitter_history   = HistoryBuffer(self.history_size, len(output_nts) * self.number_neurons)
+        self.neurotransmitter_outputs   = {}
+        for nt_index in range(len(output_nts)):
+            start = nt_index * self.number_neurons
+            stop  = start + self.number_neurons
+            self.neurotransmitter_outputs[output_nts[nt_index]] = self.neurotransmitter_history.view(start, stop)
+        self.number_updates = 0
+    
+    """
+    Get a dictionary of the (1 x neurons) neurotransmitter outputs from
+    steps_ago timesteps ago.  It is empty if the layer had not released any
+    neurotransmitters yet (e.g. at the start of a run).
+    """
+    def getNeurotransmitterOutputs(self, steps_ago):
+        if steps_ago >= self.number_updates: return {}
+        nt_outputs = {}
+        for nt, outputs in self.neurotransmitter_outputs.iteritems():
+            nt_outputs[nt] = outputs[steps_ago]
+        return nt_outputs
             
     def calculateReceptiveFieldPoints(self):
         self.receptive_field_points = set()
@@ -72,16 +157,28 @@ class BipolarLayer:
             neuron.compartmentalize(self.compartment)
             
     def loadPast(self, activity):
-        for neuron_index in range(self.number_neurons):
-            neuron = self.neurons[neuron_index]
-            neuron.loadPast(activity[0, neuron_index])
+        self.activities[0] = activity
             
+    """
+    Draw the bipolars in the colors of their current activities.  The bipolars
+    are rasterized into a label image once for each scale (and radius), so a
+    frame is drawn by copying the colors into the pixels the bipolars cover.
+    """
     def drawActivity(self, surface, colormap, activity_bounds, radius=None, scale=1.0):
         if radius == None: radius = self.nearest_neighbor_distance_gridded/2.0
         
-        radius = int(radius*scale)
-        for neuron in self.neurons:
-            neuron.drawActivity(surface, radius, colormap, activity_bounds, scale=scale)
+        colors = getColormapLUT(colormap).getColors(self.activities[0][0])
+        self.label_image_cache.draw(surface, colors, self.buildLabelImage, radius, scale)
+            
+    """
+    Rasterize the bipolars, as drawn by drawActivity, into a (height x width)
+    label image of bipolar indices
+    """
+    def buildLabelImage(self, width, height, radius=None, scale=1.0):
+        if radius == None: radius = self.nearest_neighbor_distance_gridded/2.0
+        
+        centers = [(neuron.location * scale).toIntTuple() for neuron in self.neurons]
+        return rasterizeCircles(width, height, centers, int(radius*scale), range(self.number_neurons))
             
     def draw(self, surface, radius=None, color=None, scale=1.0):
         if color == None: 
@@ -109,92 +206,49 @@ class BipolarLayer:
         if pt < -1: return 0.0
         if pt > 1: return 1.0
         return (pt+1.0)/2.0
+    def potentialsToNeurotransmitters(self, pts):
+        return np.clip((pts+1.0)/2.0, 0.0, 1.0)
             
+    """
+    Advance the histories and write the new activities and neurotransmitter
+    outputs into them.  Returns a copy of the activities since the history's
+    memory is reused on later timesteps.
+    """
     def update(self):
+        # Advance the histories so the oldest rows hold the new values
+        new_activities = self.activities.advance()
+        self.neurotransmitter_history.advance()
+        self.number_updates += 1
+        
         cone_activities         = self.cone_layer.activities[self.input_delay]
         horizontal_activities   = self.horizontal_layer.activities[self.input_delay]
         
-        new_activities = np.zeros((1, self.number_neurons))
-        for neuron_number in range(self.number_neurons):
-            neuron          = self.neurons[neuron_number]
-            new_activity    = neuron.update(cone_activities, horizontal_activities)
-            
-            new_activities[0, neuron_number] = new_activity
+        # Find the activity of each cone-horizontal triad
+        triad_activities = (cone_activities[0] - horizontal_activities[0])/2.0
+        if self.bipolar_type == "On":
+            triad_activities = -triad_activities
+        
+        # Weight the triad activities for all bipolars at once
+        new_activities[0] = self.input_weights.dot(triad_activities)
+        
+        # Update the neurotransmitter amounts that are output (all bipolars
+        # share the same compartment)
+        nt_amounts = self.potentialsToNeurotransmitters(new_activities)
+        for nt, weight in self.compartment.neurotransmitters_output_weights.iteritems():
+            self.neurotransmitter_outputs[nt][0] = weight * nt_amounts
             
-        return new_activities
+        return new_activities.copy()
             
         
     """
     Nearest neighbor distance constrained placement of points
-        The method involves tracking point locations and tracking exclusion zones around those points
-        Random points are generated until:
-            A valid point is found (one that is within the bounds and not located within an exclusion zone
-            A maximum number of tries has been exhausted
-    """
-    def placeNeurons(self, max_rand_tries=1000):
-        # Set the bounds on the positions
-        xmin = 0
-        ymin = 0
-        xmax = self.retina.grid_width-1
-        ymax = self.retina.grid_height-1
-
-        # Convert the minimum distance from world units to grid units
-        gridded_distance        = self.nearest_neighbor_distance_gridded
-        ceil_gridded_distance   = int(m.ceil(gridded_distance))
-
-        # Calculate the number of cells to place
-        required_cells = self.minimum_required_cells
-        current_cells  = 0
-
-        # Create empty sets to hold the selected positions and the excluded positions
-        excluded_positions = set()
-        self.locations = []
-
-        while current_cells < required_cells:
-
-            # Pick a random point
-            x       = random.randint(xmin, xmax)
-            y       = random.randint(ymin, ymax)
-            loc_ID  = str(x) + "." + str(y)
-            
-            # Regenerate random point until a valid point is found
-            rand_tries = 0
-            while loc_ID in excluded_positions:
-                x = random.randint(xmin, xmax)
-                y = random.randint(ymin, ymax)
-                loc_ID = str(x) + "." + str(y)
-                
-                rand_tries += 1
-                if rand_tries > max_rand_tries: break
-
-            # If too many attempts were made to generate a new point, exit loop
-            if rand_tries > max_rand_tries: break    
-
-            # Update the sets with the newly selected point
-            excluded_positions.add(loc_ID)
-            self.locations.append([x, y])
-
-            # Find the bounding box of excluded coordinates surrounding the new point
-            left    = max(x - ceil_gridded_distance, xmin)
-            right   = min(x + ceil_gridded_distance, xmax)
-            up      = max(y - ceil_gridded_distance, ymin)
-            down    = min(y + ceil_gridded_distance, ymax)
-
-            # Check if each point in the bounding box is within the minimum distance radius
-            # If so, add it to the exclusion set
-            for x2 in range(left, right+1):
-                for y2 in range(up, down+1):
-                    if linearDistance(x, y, x2, y2) < gridded_distance:
-                        loc_ID = str(x2) + "." + str(y2)
-                        excluded_positions.add(loc_ID)
-
-            current_cells += 1
-
-
-
-
-"""
-Linear distance between two points
-"""
-def linearDistance(x1, y1, x2, y2):
-    return ((x2-x1)**2.0 + (y2-y1)**2.0)**0.5
\ No newline at end of file
+        Points are placed with a Poisson-disk sampler so that no two neurons
+        are closer than the nearest neighbor distance.  The random numbers come
+        from the retina's random state, so placement can be seeded.
+    """
+    def placeNeurons(self):
+        self.locations = poissonDiskPlacement(0, self.retina.grid_width-1,
+                                              0, self.retina.grid_height-1,
+                                              self.nearest_neighbor_distance_gridded,
+                                              self.minimum_required_cells,
+                                              self.retina.random_state)
@@ -49,9 +49,9 @@ class Compartment:
             pygame.draw.circle(surface, color, point.toIntTuple(), 1)
     
     def registerWithRetina(self, neuron, compartment_index):
-        for point in self.gridded_locations:
-            point = neuron.location + point
-            self.retina.register(neuron, self, compartment_index, point)
+        locations = [(point.x, point.y) for point in self.gridded_locations]
+        locations = np.array(locations, dtype=float).reshape(-1, 2) + neuron.location.toTuple()
+        self.retina.registerLocations(neuron, self, compartment_index, locations)
     
     def getSize(self):
         return len(self.points)
@@ -126,9 +126,9 @@ class GrowingCompartment(Compartment):
             self.neurotransmitters_output_weights[nt] /= number_points
                 
     def registerWithRetina(self, neuron, compartment_index):
-        for point in self.points:
-            location = point.location + neuron.location
-            self.retina.register(neuron, self, compartment_index, location)
+        locations = [point.location.toTuple() for point in self.points]
+        locations = np.array(locations, dtype=float).reshape(-1, 2) + neuron.location.toTuple()
+        self.retina.registerLocations(neuron, self, compartment_index, locations)
             
     def colorCompartments(self, colors, index):
         self.color = colors[index]
@@ -1,19 +1,12 @@
-import math as m
-import random
 import numpy as np
+from scipy import sparse
 from Constants import *
 
 
-"""
-Linear distance between two points
-"""
-def linearDistance(x1, y1, x2, y2):
-    return ((x2-x1)**2.0 + (y2-y1)**2.0)**0.5
-
 class ConeLayer:
 
     def __init__(self, retina, nearest_neighbor_distance, minimum_required_density,
-                 input_field_radius, history_size, stimulus):
+                 input_field_radius, history_size, stimulus, locations=None, input_weights=None):
 
         self.retina = retina
         
@@ -29,28 +22,46 @@ class ConeLayer:
         
         self.stimulus           = stimulus
         
-        self.placeNeurons()
+        # The locations can be given (e.g. by a saved snapshot) instead of 
+        # placing the neurons
+        if locations == None:   self.placeNeurons()
+        else:                   self.locations = locations
         self.neurons = len(self.locations)
 
         self.history_size = history_size
         self.initializeActivties()
-
-        self.establishInputs()        
+        self.label_image_cache = LabelImageCache()
+
+        # The input weights can be given (e.g. by a saved snapshot of a retina
+        # with the same stimulus) instead of finding the pixels that each cone
+        # overlaps
+        if input_weights is None:   self.establishInputs()
+        else:                       self.loadInputs(input_weights)
+        self.precomputeFrameActivities()
     
     def loadPast(self, activity):
         self.activities[0] = activity
         
+    """
+    Draw the neurons in the colors of their current activities.  The neurons are
+    rasterized into a label image once for each scale (and radius), so a frame
+    is drawn by copying the colors into the pixels the neurons cover.
+    """
     def drawActivity(self, surface, colormap, activity_bounds, radius=None, scale=1.0):
         if radius == None: radius = self.nearest_neighbor_distance_gridded/2.0
-        min_activity, max_activity = activity_bounds
         
-        radius  = int(radius*scale)
-        for n in range(self.neurons):
-            activity = self.activities[0][0, n]
-            color = getColorFromActivity(colormap, activity) 
-            x, y = self.locations[n]
-            x, y = int(x*scale), int(y*scale)
-            pygame.draw.circle(surface, color, (x, y), radius) 
+        colors = getColormapLUT(colormap).getColors(self.activities[0][0])
+        self.label_image_cache.draw(surface, colors, self.buildLabelImage, radius, scale)
+    
+    """
+    Rasterize the neurons, as drawn by drawActivity, into a (height x width)
+    label image of neuron indices
+    """
+    def buildLabelImage(self, width, height, radius=None, scale=1.0):
+        if radius == None: radius = self.nearest_neighbor_distance_gridded/2.0
+        
+        centers = [(int(x*scale), int(y*scale)) for x, y in self.locations]
+        return rasterizeCircles(width, height, centers, int(radius*scale), range(self.neurons))
     
     def draw(self, surface, radius=None, color=None, scale=1.0):     
         if radius == None: radius = self.nearest_neighbor_distance_gridded/2.0
@@ -73,37 +84,70 @@ class ConeLayer:
             
 
     def initializeActivties(self):
-        self.activities = []
-        for i in range(self.history_size):
-            self.activities.append(np.zeros((1, self.neurons)))
+        self.activities = HistoryBuffer(self.history_size, self.neurons)
             
 
+    """
+    Advance the history and write the new activity into it.  Returns a copy of
+    the activity since the history's memory is reused on later timesteps.
+    """
     def update(self):
 
-        del self.activities[-1]
-        currentActivities = np.zeros((1, self.neurons))
-        
-        for n in range(self.neurons):
-            x, y = self.locations[n]
-            locID = str(x)+"."+str(y)
-            connectedPixels = self.inputs[locID]
-            coneActivity = 0.0
-            for pixel in connectedPixels:
-                pixelID, pixelWeight = pixel
-                intensity = self.stimulus.getPixelIntensity(pixelID)
-                coneActivity += (intensity*-2.0 + 1.0) * pixelWeight
-            currentActivities[0, n] = coneActivity
-            
-        self.activities.insert(0, currentActivities)
+        current_activities = self.activities.advance()
+        
+        # Cone activities only change when the stimulus changes frames
+        frame_index = self.stimulus.getFrameIndex()
+        if self.frame_activities is not None:
+            current_activities[0] = self.frame_activities[frame_index]
+        elif frame_index == self.last_frame_index:
+            current_activities[...] = self.activities[1]
+        else:
+            current_activities[0] = self.calculateActivities(self.stimulus.getPixelIntensities())
+            self.last_frame_index = frame_index
         
-        return currentActivities
+        return current_activities.copy()
+    
+    """
+    Convert pixel intensities into cone activities (white = -1, black = 1)
+    and weight them by each cone's overlap with the pixels in a single sparse
+    (cones x pixels) matrix product.  The intensities can be a (pixels) vector
+    or a (pixels x frames) matrix.
+    """
+    def calculateActivities(self, pixel_intensities):
+        pixel_activities = pixel_intensities * -2.0 + 1.0
+        return self.input_weights.dot(pixel_activities)
+    
+    """
+    If the stimulus has been rendered ahead of time, find the cone activities
+    for every frame with batched (cones x pixels) x (pixels x frames) products,
+    so that updating the cones is just a lookup of the current frame.  The
+    frames are processed in chunks to limit the memory used.  Otherwise, the
+    activities are calculated as the stimulus changes frames.
+    """
+    def precomputeFrameActivities(self, frames_per_chunk=64):
+        self.frame_activities   = None
+        self.last_frame_index   = None
+        if not(self.stimulus.hasPrecomputedFrames()): return
+        
+        number_frames           = self.stimulus.getNumberFrames()
+        self.frame_activities   = np.zeros((number_frames, self.neurons))
+        for start in range(0, number_frames, frames_per_chunk):
+            end = min(start + frames_per_chunk, number_frames)
+            pixel_intensities = self.stimulus.getFramePixelIntensities(start, end)
+            self.frame_activities[start:end] = self.calculateActivities(pixel_intensities.T).T
             
             
     
     def establishInputs(self):
         self.inputs = {}     
-        for loc_ID in self.locations:
-            x, y = loc_ID
+        
+        # Row (cone), column (pixel) and weight triplets for the sparse matrix
+        cone_numbers    = []
+        pixel_numbers   = []
+        pixel_weights   = []
+        
+        for cone_number in range(self.neurons):
+            x, y = self.locations[cone_number]
 
             gridded_radius = self.input_field_radius_gridded
             
@@ -118,6 +162,34 @@ class ConeLayer:
             
             loc_ID = str(x)+"."+str(y)
             self.inputs[loc_ID] = connected_pixels
+            
+            for pixel_ID, pixel_weight in connected_pixels:
+                cone_numbers.append(cone_number)
+                pixel_numbers.append(self.stimulus.getPixelNumber(pixel_ID))
+                pixel_weights.append(pixel_weight)
+        
+        # Build the (cones x pixels) input weight matrix
+        number_pixels       = self.stimulus.width_in_pixels * self.stimulus.height_in_pixels
+        self.input_weights  = sparse.csr_matrix((pixel_weights, (cone_numbers, pixel_numbers)),
+                                                shape=(self.neurons, number_pixels))
+    
+    """
+    Use a (cones x pixels) sparse weight matrix, like the one built by
+    establishInputs, and set the connected pixels of each cone from its row
+    """
+    def loadInputs(self, input_weights):
+        self.input_weights  = sparse.csr_matrix(input_weights)
+        indptr              = self.input_weights.indptr
+        height              = self.stimulus.height_in_pixels
+        
+        self.inputs = {}
+        for cone_number in range(self.neurons):
+            x, y            = self.locations[cone_number]
+            start, stop     = indptr[cone_number], indptr[cone_number + 1]
+            pixel_numbers   = self.input_weights.indices[start:stop].tolist()
+            pixel_weights   = self.input_weights.data[start:stop].tolist()
+            self.inputs[str(x)+"."+str(y)] = [[str(pixel_number // height)+"."+str(pixel_number % height), pixel_weight]
+                                              for pixel_number, pixel_weight in zip(pixel_numbers, pixel_weights)]
 
 
     def inputWeightingFunction(self, inputs):
@@ -136,66 +208,13 @@ class ConeLayer:
 
     """
     Nearest neighbor distance constrained placement of points
-        The method involves tracking point locations and tracking exclusion zones around those points
-        Random points are generated until:
-            A valid point is found (one that is within the bounds and not located within an exclusion zone
-            A maximum number of tries has been exhausted
+        Points are placed with a Poisson-disk sampler so that no two neurons
+        are closer than the nearest neighbor distance.  The random numbers come
+        from the retina's random state, so placement can be seeded.
     """
-    def placeNeurons(self, max_rand_tries=1000):
-        # Set the bounds on the positions
-        xmin = 0
-        ymin = 0
-        xmax = self.retina.grid_width-1
-        ymax = self.retina.grid_height-1
-
-        # Convert the minimum distance from world units to grid units
-        gridded_distance        = self.nearest_neighbor_distance_gridded
-        ceil_gridded_distance   = int(m.ceil(gridded_distance))
-
-        # Calculate the number of cells to place
-        required_cells = self.minimum_required_cells
-        current_cells  = 0
-
-        # Create empty sets to hold the selected positions and the excluded positions
-        excluded_positions = set()
-        self.locations = []
-
-        while current_cells < required_cells:
-
-            # Pick a random point
-            x       = random.randint(xmin, xmax)
-            y       = random.randint(ymin, ymax)
-            loc_ID  = str(x) + "." + str(y)
-            
-            # Regenerate random point until a valid point is found
-            rand_tries = 0
-            while loc_ID in excluded_positions:
-                x = random.randint(xmin, xmax)
-                y = random.randint(ymin, ymax)
-                loc_ID = str(x) + "." + str(y)
-                
-                rand_tries += 1
-                if rand_tries > max_rand_tries: break
-
-            # If too many attempts were made to generate a new point, exit loop
-            if rand_tries > max_rand_tries: break    
-
-            # Update the sets with the newly selected point
-            excluded_positions.add(loc_ID)
-            self.locations.append([x, y])
-
-            # Find the bounding box of excluded coordinates surrounding the new point
-            left    = max(x - ceil_gridded_distance, xmin)
-            right   = min(x + ceil_gridded_distance, xmax)
-            up      = max(y - ceil_gridded_distance, ymin)
-            down    = min(y + ceil_gridded_distance, ymax)
-
-            # Check if each point in the bounding box is within the minimum distance radius
-            # If so, add it to the exclusion set
-            for x2 in range(left, right+1):
-                for y2 in range(up, down+1):
-                    if linearDistance(x, y, x2, y2) < gridded_distance:
-                        loc_ID = str(x2) + "." + str(y2)
-                        excluded_positions.add(loc_ID)
-
-            current_cells += 1
+    def placeNeurons(self):
+        self.locations = poissonDiskPlacement(0, self.retina.grid_width-1,
+                                              0, self.retina.grid_height-1,
+                                              self.nearest_neighbor_distance_gridded,
+                                              self.minimum_required_cells,
+                                              self.retina.random_state)
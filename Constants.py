@@ -29,6 +29,54 @@ def getColorFromActivity(colormap, activity):
 BLUE_RED_COLORMAP = [[-1.0, pygame.Color(0,0,255)], [0.0, pygame.Color(0,0,0)], [1.0, pygame.Color(255,0,0)]]
 
 
+"""
+A lookup table of (R,G,B) colors for a colormap.  The colormap is sampled at
+number_colors evenly spaced values between its first and last values, so a
+whole array of activities can be mapped to colors with one indexing operation
+instead of searching the colormap for each activity.  Activities outside of the
+colormap get the color at the nearest end of the colormap.
+"""
+class ColormapLUT(object):
+    
+    def __init__(self, colormap, number_colors=1024):
+        values = [value for value, color in colormap]
+        colors = np.array([[color.r, color.g, color.b] for value, color in colormap], dtype=float)
+        
+        self.min_value      = float(values[0])
+        self.max_value      = float(values[-1])
+        self.number_colors  = number_colors
+        
+        samples     = np.linspace(self.min_value, self.max_value, number_colors)
+        self.colors = np.zeros((number_colors, 3), dtype=np.uint8)
+        for channel in range(3):
+            self.colors[:, channel] = np.interp(samples, values, colors[:, channel]).astype(int)
+    
+    """
+    Get the table indices of an array of activities
+    """
+    def getIndices(self, activities):
+        scale   = (self.number_colors - 1) / (self.max_value - self.min_value)
+        indices = np.rint((np.asarray(activities) - self.min_value) * scale)
+        return np.clip(indices, 0, self.number_colors - 1).astype(np.intp)
+    
+    """
+    Get the (... x 3) uint8 colors of an array of activities
+    """
+    def getColors(self, activities):
+        return self.colors[self.getIndices(activities)]
+
+"""
+Get the lookup table of a colormap.  Tables are built the first time they are
+needed and then kept, keyed by the colormap's values and colors.
+"""
+COLORMAP_LUTS = {}
+def getColormapLUT(colormap, number_colors=1024):
+    key = (tuple([(value, tuple(color)) for value, color in colormap]), number_colors)
+    if key not in COLORMAP_LUTS: 
+        COLORMAP_LUTS[key] = ColormapLUT(colormap, number_colors)
+    return COLORMAP_LUTS[key]
+
+
 UM_TO_M = 1/1000000.0
 M_TO_UM = 1/UM_TO_M
 
@@ -55,8 +103,15 @@ ICED_COFFEE         = [(231,243,239),(140,100,41),(85,195,220),(226,75,44),(115,
 
 from BarStimulus import BarStimulus
 from RuntimeBarGenerator import RuntimeBarGenerator
+from AnalyticBarGenerator import AnalyticBarGenerator
+from PrecomputedBarMovie import PrecomputedBarMovie
 
 from Vector2D import Vector2D
+from HistoryBuffer import HistoryBuffer
+from Rasterize import createLabelSurface, getLabelColor, readLabelImage, rasterizeCircles, LabelImageCache
+from ActivityRecorder import ActivityRecorder
+from SpatialRegistry import SpatialRegistry
+from PoissonDiskPlacement import poissonDiskPlacement
 
 from ConeLayer import ConeLayer
 from HorizontalLayer import HorizontalLayer
@@ -69,10 +124,15 @@ from BipolarLayer import BipolarLayer
 from Compartment import Compartment
 from Compartment import GrowingCompartment
 from StarburstDendrite import DendriteSegment
+from MorphologyLibrary import MorphologyLibrary
 from StarburstMorphology import StarburstMorphology
+from StarburstMorphology import growMorphologyDescription, initializeGrowthWorker
 from Starburst import Starburst
 from StarburstLayer import StarburstLayer
+from StarburstLayer import drawMorphologySeeds, getMorphologyParameters
 from Retina import Retina
+from RetinaSnapshot import saveRetinaSnapshot, loadRetinaSnapshot
+from ActivityRenderer import ActivityRenderer, renderRetina
 
 
         
@@ -0,0 +1,89 @@
+"""
+HistoryBuffer class
+
+A fixed-size history of activities stored in one preallocated numpy array of
+size (history_size x number_values).  Instead of deleting the oldest activity
+and inserting a new one at the front of a list, a head index is rotated, so
+advancing the history does not allocate memory.
+
+Indexing works like the old activity lists:
+    history[0] is the current (1 x number_values) activity
+    history[k] is the activity from k timesteps ago
+    history[-1] is the oldest activity
+These are views into the buffer, so writing into them writes into the history.
+
+Methods:
+    advance - rotate the history so the oldest row becomes the current row
+    view - create a HistoryBufferView of a range of columns that follows the
+           rotation of the history (e.g. the compartments of one neuron)
+    toArray - copy of the history ordered from newest to oldest
+    loadArray - replace the history with an array ordered like toArray's
+"""
+
+import numpy as np
+
+class HistoryBuffer(object):
+
+    def __init__(self, history_size, number_values):
+        self.history_size   = history_size
+        self.number_values  = number_values
+        self.buffer         = np.zeros((history_size, number_values))
+        self.head           = 0
+
+    def __len__(self):
+        return self.history_size
+
+    def __getitem__(self, steps_ago):
+        row = (self.head + steps_ago) % self.history_size
+        return self.buffer[row:row+1]
+
+    def __setitem__(self, steps_ago, activity):
+        self[steps_ago][...] = activity
+
+    """
+    Rotate the head so that the oldest activity becomes the current activity.
+    The returned (1 x number_values) view should be filled with the new activity.
+    """
+    def advance(self):
+        self.head = (self.head - 1) % self.history_size
+        return self[0]
+
+    def view(self, start, stop):
+        return HistoryBufferView(self, start, stop)
+
+    def toArray(self):
+        rows = (self.head + np.arange(self.history_size)) % self.history_size
+        return self.buffer[rows]
+
+    """
+    Fill the history from a (history_size x number_values) array ordered from
+    newest to oldest (e.g. one saved from toArray).  The buffer is written in
+    place, so existing views keep following the history.
+    """
+    def loadArray(self, history):
+        self.buffer[...]    = history
+        self.head           = 0
+
+
+
+"""
+A window onto the columns [start, stop) of a HistoryBuffer.  It shares the
+buffer's memory and head, so it never needs to be updated when the buffer
+advances.
+"""
+class HistoryBufferView(object):
+
+    def __init__(self, history, start, stop):
+        self.history        = history
+        self.start          = start
+        self.stop           = stop
+        self.number_values  = stop - start
+
+    def __len__(self):
+        return len(self.history)
+
+    def __getitem__(self, steps_ago):
+        return self.history[steps_ago][:, self.start:self.stop]
+
+    def __setitem__(self, steps_ago, activity):
+        self[steps_ago][...] = activity
@@ -1,4 +1,6 @@
 import numpy as np
+from scipy import sparse
+from scipy.spatial import cKDTree
 from Constants import *
 
 
@@ -6,7 +8,8 @@ from Constants import *
 class HorizontalLayer:
 
     def __init__(self, retina, cone_layer, input_delay, history_size, 
-                 input_strength, decay_rate, diffusion_width):
+                 input_strength, decay_rate, diffusion_width, diffusion_cutoff=None,
+                 lateral_weights=None):
 
         self.retina     = retina
         self.cone_layer = cone_layer
@@ -20,11 +23,19 @@ class HorizontalLayer:
         self.diffusion_width            = diffusion_width
         self.diffusion_width_gridded    = diffusion_width / retina.grid_size
         
+        # When set, only cells within diffusion_cutoff * diffusion_width of each
+        # other are connected and diffusion is run on a sparse weight matrix
+        self.diffusion_cutoff           = diffusion_cutoff
+        
         self.locations  = cone_layer.locations
         self.neurons    = len(self.locations)
         self.initializeActivties()
+        self.label_image_cache = LabelImageCache()
 
-        self.establishLateralConnections()
+        # The lateral weights can be given (e.g. by a saved snapshot) instead of
+        # calculating them from the locations
+        if lateral_weights is None: self.establishLateralConnections()
+        else:                       self.setLateralWeights(lateral_weights)
         
         self.decay_rate         = decay_rate
         self.input_strength     = input_strength
@@ -33,17 +44,26 @@ class HorizontalLayer:
     def loadPast(self, activity):
         self.activities[0] = activity
     
+    """
+    Draw the neurons in the colors of their current activities.  The neurons are
+    rasterized into a label image once for each scale (and radius), so a frame
+    is drawn by copying the colors into the pixels the neurons cover.
+    """
     def drawActivity(self, surface, colormap, activity_bounds, radius=None, scale=1.0):
         if radius == None: radius = self.nearest_neighbor_distance_gridded/2.0
-        min_activity, max_activity = activity_bounds
         
-        radius  = int(radius*scale)
-        for n in range(self.neurons):
-            activity = self.activities[0][0, n]
-            color = getColorFromActivity(colormap, activity)    
-            x, y = self.locations[n]
-            x, y = int(x*scale), int(y*scale)
-            pygame.draw.circle(surface, color, (x, y), radius) 
+        colors = getColormapLUT(colormap).getColors(self.activities[0][0])
+        self.label_image_cache.draw(surface, colors, self.buildLabelImage, radius, scale)
+    
+    """
+    Rasterize the neurons, as drawn by drawActivity, into a (height x width)
+    label image of neuron indices
+    """
+    def buildLabelImage(self, width, height, radius=None, scale=1.0):
+        if radius == None: radius = self.nearest_neighbor_distance_gridded/2.0
+        
+        centers = [(int(x*scale), int(y*scale)) for x, y in self.locations]
+        return rasterizeCircles(width, height, centers, int(radius*scale), range(self.neurons))
     
     def draw(self, surface, inflate_radius=0.0, radius=None, color=None, scale=1.0):     
         if radius == None: radius = self.nearest_neighbor_distance_gridded/2.0
@@ -61,6 +81,7 @@ class HorizontalLayer:
         string += "\nNumber of Neurons\t\t\t"+str(self.neurons)
         string += "\nInput Delay (timesteps)\t\t\t"+str(self.input_delay)
         string += "\nDiffusion Width (um)\t\t\t"+str(self.diffusion_width * M_TO_UM)
+        string += "\nDiffusion Cutoff (widths)\t\t"+str(self.diffusion_cutoff)
         string += "\nDecay Rate\t\t\t\t"+str(self.decay_rate)
         string += "\nInput Strength:\t\t\t\t"+str(self.input_strength)
         return string    
@@ -71,6 +92,10 @@ class HorizontalLayer:
     a gaussian to those distances and then normalizes the sum of each row to 1
     """
     def establishLateralConnections(self):
+        if self.diffusion_cutoff != None:
+            self.establishSparseLateralConnections()
+            return
+        
         # An (n x n) array
         distances = np.zeros((self.neurons, self.neurons))
         
@@ -94,27 +119,117 @@ class HorizontalLayer:
         row_sum.shape = (self.neurons, 1)
         
         # Normalize the weight matrix
-        self.lateral_weights = self.lateral_weights / row_sum
-        self.diffusion_weights = self.lateral_weights
+        self.setLateralWeights(self.lateral_weights / row_sum)
+        
+    """
+    Sparse version of establishLateralConnections.  Only horizontal cells that
+    are within diffusion_cutoff * diffusion_width of each other are connected.
+    The neighbors are found with a KD-tree, the gaussian weights are stored in a
+    sparse matrix and each row is normalized to sum to 1 over the kept neighbors.
+    Memory and the cost of each update grow linearly with the number of cells.
+    """
+    def establishSparseLateralConnections(self):
+        sigma           = self.diffusion_width_gridded
+        cutoff_distance = self.diffusion_cutoff * sigma
+        
+        # Find all pairs of cells (i < j) within the cutoff distance
+        points  = np.array(self.locations, dtype=float)
+        tree    = cKDTree(points)
+        pairs   = tree.query_pairs(cutoff_distance, output_type="ndarray")
+        
+        # Connect each pair in both directions and connect each cell to itself
+        self_indices    = np.arange(self.neurons)
+        rows            = np.concatenate((pairs[:, 0], pairs[:, 1], self_indices))
+        cols            = np.concatenate((pairs[:, 1], pairs[:, 0], self_indices))
+        
+        # Perform e^(-distance**2/width) on each connection
+        distances   = np.sqrt(np.sum((points[rows] - points[cols])**2.0, 1))
+        weights     = np.exp(-(distances)**2/(2.0*sigma**2.0))
+        
+        # Normalize the weights so that the sum of each row is 1
+        row_sum     = np.bincount(rows, weights, self.neurons)
+        weights     = weights / row_sum[rows]
+        
+        self.setLateralWeights(sparse.csr_matrix((weights, (rows, cols)),
+                                                 shape=(self.neurons, self.neurons)))
+        
+    """
+    Use a (neurons x neurons) lateral weight matrix for diffusion - a dense
+    array, or a sparse matrix if diffusion_cutoff is set
+    """
+    def setLateralWeights(self, lateral_weights):
+        self.lateral_weights    = lateral_weights
+        self.diffusion_weights  = lateral_weights
+        
+        # Store the sparse connections as an edge list for use in update
+        if sparse.issparse(lateral_weights):
+            edges = lateral_weights.tocoo()
+            self.diffusion_rows     = edges.row
+            self.diffusion_cols     = edges.col
+            self.diffusion_values   = edges.data
+        
+    """
+    Perform one step of diffusion using the sparse connections.  This follows
+    the same rule as calculateDenseDiffusion: each connection
+    carries weight * (activity_i - activity_j) from i to j when that amount is
+    positive.
+    """
+    def calculateSparseDiffusion(self, last_activity):
+        activity    = last_activity[0]
+        flows       = (activity[self.diffusion_rows] - activity[self.diffusion_cols]) * self.diffusion_values
+        flows[flows < 0] = 0
+        
+        # Subtract what each cell sends out and add what it receives
+        sent_activity       = np.bincount(self.diffusion_rows, flows, self.neurons)
+        received_activity   = np.bincount(self.diffusion_cols, flows, self.neurons)
+        diffusion_activity  = activity - sent_activity + received_activity
+        
+        diffusion_activity.shape = (1, self.neurons)
+        return diffusion_activity
         
         
     """
     Initialize a zero-filled history activity 
     """
     def initializeActivties(self):
-        self.activities = []
-        for i in range(self.history_size):
-            blank_activity = np.zeros((1, self.neurons))
-            self.activities.append(blank_activity)
+        self.activities = HistoryBuffer(self.history_size, self.neurons)
             
     """
-    Update the horizontal cell activity based on diffusion, decay and cone activity 
+    Update the horizontal cell activity based on diffusion, decay and cone activity.
+    Returns a copy of the activity since the history's memory is reused on 
+    later timesteps.
     """      
     def update(self):
-        # Delete the oldest activity and get the current activity
-        del self.activities[-1]
-        last_activity = self.activities[0]
+        # Advance the history so the last activity is one step ago
+        self.activities.advance()
+        last_activity = self.activities[1]
         
+        if self.diffusion_cutoff != None:
+            diffusion_activity = self.calculateSparseDiffusion(last_activity)
+        else:
+            diffusion_activity = self.calculateDenseDiffusion(last_activity)
+               
+        # Get the cone activity
+        cone_activity   = self.cone_layer.activities[self.input_delay]
+        
+        # Find the new activity
+        i = self.input_strength
+        d = self.decay_rate
+        new_activity = (1.0-i) * (1.0-d) * diffusion_activity + i * cone_activity
+        
+        # Alternative method of updating, no weighted average with cone input
+#        new_activity = diffusionActivity + i * cone_activity
+#        new_activity = np.clip(new_activity, -1.0, 1.0)        
+        
+        # Store the most recent activity at the front of the history
+        self.activities[0] = new_activity
+        
+        return self.activities[0].copy()
+        
+    """
+    Perform one step of diffusion using the dense (n x n) weight matrix
+    """
+    def calculateDenseDiffusion(self, last_activity):
         # Create the activity difference matrix where:
         #   Dij = compartment i activity - compartment j activity
         #   This matrix describes the concentration gradient
@@ -142,24 +257,9 @@ class HorizontalLayer:
         diffusion_activity = np.sum(differences, 0) + self_activities
         
         # np.sum removes a dimension, so let's restore it.
-        diffusion_activity.shape = (1, self.neurons)         
-               
-        # Get the cone activity
-        cone_activity   = self.cone_layer.activities[self.input_delay]
-        
-        # Find the new activity
-        i = self.input_strength
-        d = self.decay_rate
-        new_activity = (1.0-i) * (1.0-d) * diffusion_activity + i * cone_activity
-        
-        # Alternative method of updating, no weighted average with cone input
-#        new_activity = diffusionActivity + i * cone_activity
-#        new_activity = np.clip(new_activity, -1.0, 1.0)        
-        
-        # Add the most recent activity to the front of the list
-        self.activities.insert(0, new_activity)
+        diffusion_activity.shape = (1, self.neurons)
         
-        return new_activity
+        return diffusion_activity
     
 
 
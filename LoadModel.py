@@ -1,8 +1,9 @@
-import pickle, os
+import os
+from Constants import *
 
 save_directory  = os.path.join("Saved Retinas", "Diffuse Bipolar")
-saved_path      = os.path.join(os.getcwd(), save_directory, "retina.p")
-retina = pickle.load(open(saved_path, "rb"))
+saved_path      = os.path.join(os.getcwd(), save_directory)
+retina = loadRetinaSnapshot(saved_path)
 
 from Visualizer import Visualizer
 
@@ -0,0 +1,97 @@
+import os
+import pickle
+import hashlib
+
+
+"""
+MorphologyLibrary class
+
+An on-disk cache of grown starburst morphologies.  Growing a morphology (growth,
+compartmentalization, shortest paths and diffusion weights) is slow, but it is
+completely determined by the StarburstMorphology constructor arguments and the
+seed of its random number generator.  Each morphology is stored as the compact
+description returned by StarburstMorphology.describe, pickled into a file named
+by a hash of those arguments and the seed.
+
+The library is limited to max_size bytes.  When it grows beyond that, the least
+recently used entries (by file modification time, which is refreshed whenever
+an entry is loaded) are deleted.
+"""
+class MorphologyLibrary:
+
+    def __init__(self, directory="Morphology Library", max_size=512*1024**2):
+        self.directory  = directory
+        self.max_size   = max_size
+
+        if not(os.path.exists(self.directory)):
+            os.makedirs(self.directory)
+
+    """
+    Build the key for a morphology from a list of (name, value) parameter pairs
+    and a random seed
+    """
+    def buildKey(self, parameters, random_seed):
+        parameter_string = repr((sorted(parameters), random_seed))
+        return hashlib.sha1(parameter_string).hexdigest()
+
+    def getPath(self, key):
+        return os.path.join(self.directory, key + ".p")
+
+    """
+    Return the description stored under key or None if the library does not
+    have it
+    """
+    def load(self, key):
+        path = self.getPath(key)
+        if not(os.path.exists(path)): return None
+
+        try:
+            fh = open(path, "rb")
+            description = pickle.load(fh)
+            fh.close()
+        except (IOError, EOFError, pickle.UnpicklingError):
+            return None
+
+        # Mark the entry as recently used
+        os.utime(path, None)
+        return description
+
+    """
+    Store a description under key and then evict entries if the library has
+    grown too large.  The file is written under a temporary name and then
+    renamed so that a partially written entry is never loaded.
+    """
+    def save(self, key, description):
+        path            = self.getPath(key)
+        temporary_path  = path + ".{0}.tmp".format(os.getpid())
+
+        fh = open(temporary_path, "wb")
+        pickle.dump(description, fh, pickle.HIGHEST_PROTOCOL)
+        fh.close()
+        if os.path.exists(path): os.remove(path)
+        os.rename(temporary_path, path)
+
+        self.evict()
+
+    """
+    Delete the least recently used entries until the library fits in max_size
+    """
+    def evict(self):
+        entries = []
+        for filename in os.listdir(self.directory):
+            if not(filename.endswith(".p")): continue
+            path = os.path.join(self.directory, filename)
+            try:
+                entries.append([os.path.getmtime(path), os.path.getsize(path), path])
+            except OSError:
+                continue
+
+        total_size = sum([size for (time, size, path) in entries])
+        entries.sort()
+        for time, size, path in entries:
+            if total_size <= self.max_size: break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_size -= size
@@ -143,12 +143,15 @@ class Visualizer:
         self.on_starburst_color_deselected  = lerpColors(self.on_starburst_color, self.visualization_background_color, 0.85)
         self.off_starburst_color_deselected = lerpColors(self.off_starburst_color, self.visualization_background_color, 0.85)
         
-        self.cone_activities            = r.cone_activities
-        self.horizontal_activities      = r.horizontal_activities
-        self.on_bipolar_activities      = r.on_bipolar_activities
-        self.off_bipolar_activities     = r.off_bipolar_activities
-        self.on_starburst_activities    = r.on_starburst_activities
-        self.off_starburst_activities   = r.off_starburst_activities
+        # The activities are read through the retina, so that recorded
+        # activities are played back from disk
+        layer_activities = [r.getLayerActivities(i) for i in range(r.number_layers)]
+        self.cone_activities            = layer_activities[0]
+        self.horizontal_activities      = layer_activities[1]
+        self.on_bipolar_activities      = layer_activities[2]
+        self.off_bipolar_activities     = layer_activities[3]
+        self.on_starburst_activities    = layer_activities[4]
+        self.off_starburst_activities   = layer_activities[5]
         
         self.cone_activity_bounds           = r.activity_bounds[0]
         self.horizontal_activity_bounds     = r.activity_bounds[1]
@@ -160,7 +163,8 @@ class Visualizer:
         self.colormap = [[-1.0, pygame.Color(0,0,255)], [0.0, pygame.Color(0,0,0)], [1.0, pygame.Color(255,0,0)]]
         
         self.timestep       = 0
-        self.end_timestep   = len(self.cone_activities) - 1    
+        number_steps        = [len(activities) for activities in layer_activities if activities is not None]
+        self.end_timestep   = max(max(number_steps or [1]) - 1, 0)
     
     def visualizeCellPlacement(self, surface, cell_type, scale=1.0):
         if cell_type == None:
@@ -212,7 +216,7 @@ class Visualizer:
                     
             elif vis_type == "Activity":
                 if cell_type != None:
-                    self.retina.loadPast(self.timestep)
+                    self.retina.loadPast(self.timestep, cell_type)
                     self.retina.drawLayerActivity(surface, cell_type, self.colormap, scale)
                     pygame.display.set_caption(vis_type + " " + str(cell_type) + " " + str(self.timestep))
                     
@@ -0,0 +1,113 @@
+"""
+Poisson-disk placement of neurons
+
+Places points on the integer retinal grid so that no two points are closer than
+a minimum distance, using Bridson's algorithm ("Fast Poisson Disk Sampling in
+Arbitrary Dimensions", 2007).  A background grid with cells of size
+minimum_distance/sqrt(2) holds at most one point per cell, so checking whether
+a candidate is too close to an existing point only requires looking at the
+points in the surrounding cells.
+
+Bridson's algorithm grows a mosaic outwards from a seed point until the bounds
+are filled.  If the filled mosaic has more points than are required, a random
+subset of them is kept so that the points are still spread across the whole
+of the bounds (any subset of a Poisson-disk sample satisfies the minimum
+distance).  If it has fewer, all of the points are returned, just like the old
+rejection sampler gave up once no more points could be found.
+"""
+
+import math as m
+import numpy as np
+
+
+"""
+Place up to required_points integer grid points within [xmin, xmax] x [ymin, ymax]
+such that no two points are closer than minimum_distance (all in grid units).
+    random_state - numpy RandomState used for all random numbers (so that the
+                   placement can be seeded); a new one is created if None
+    candidates_per_point - number of candidates generated around an active point
+                           before it is retired (Bridson's k)
+Returns a list of [x, y] locations.
+"""
+def poissonDiskPlacement(xmin, xmax, ymin, ymax, minimum_distance, required_points,
+                         random_state=None, candidates_per_point=30):
+    if random_state is None: random_state = np.random.RandomState()
+    if required_points <= 0: return []
+
+    distance = float(minimum_distance)
+
+    # Distinct integer points are always at least 1 grid unit apart, so any
+    # distinct grid points will do
+    if distance <= 1.0:
+        lattice_height  = ymax - ymin + 1
+        lattice_size    = (xmax - xmin + 1) * lattice_height
+        selected        = random_state.permutation(lattice_size)[:required_points]
+        locations       = np.column_stack((xmin + selected // lattice_height,
+                                           ymin + selected % lattice_height))
+        return locations.tolist()
+
+    # The cells never need to be smaller than 1 grid unit to hold a single point
+    cell_size       = max(distance / m.sqrt(2.0), 1.0)
+    search_cells    = int(m.ceil(distance / cell_size))
+    grid_width      = int((xmax - xmin) / cell_size) + 1
+    grid_height     = int((ymax - ymin) / cell_size) + 1
+
+    # Background grid of point indices (-1 is an empty cell)
+    grid        = np.zeros((grid_width, grid_height), dtype=np.int64) - 1
+    locations   = np.zeros((grid_width * grid_height, 2))
+
+    def isValid(x, y):
+        if x < xmin or x > xmax or y < ymin or y > ymax: return False
+
+        grid_x = int((x - xmin) / cell_size)
+        grid_y = int((y - ymin) / cell_size)
+        left    = max(grid_x - search_cells, 0)
+        right   = min(grid_x + search_cells + 1, grid_width)
+        up      = max(grid_y - search_cells, 0)
+        down    = min(grid_y + search_cells + 1, grid_height)
+
+        neighbors = grid[left:right, up:down]
+        neighbors = neighbors[neighbors >= 0]
+        if len(neighbors) == 0: return True
+
+        differences = locations[neighbors] - (x, y)
+        return np.all(np.sum(differences**2, 1) >= distance**2)
+
+    def addPoint(x, y):
+        index = number_points[0]
+        locations[index] = (x, y)
+        grid[int((x - xmin) / cell_size), int((y - ymin) / cell_size)] = index
+        number_points[0] += 1
+        return index
+
+    number_points   = [0]
+    active          = [addPoint(random_state.randint(xmin, xmax + 1),
+                                random_state.randint(ymin, ymax + 1))]
+
+    while active != []:
+        active_index    = random_state.randint(len(active))
+        x, y            = locations[active[active_index]]
+
+        # Generate candidates in the annulus [distance, 2*distance) around the
+        # active point and snap them to the grid
+        angles          = random_state.uniform(0.0, 2.0 * m.pi, candidates_per_point)
+        radii           = random_state.uniform(distance, 2.0 * distance, candidates_per_point)
+        candidates_x    = np.round(x + radii * np.cos(angles))
+        candidates_y    = np.round(y + radii * np.sin(angles))
+
+        found_point = False
+        for candidate_x, candidate_y in zip(candidates_x, candidates_y):
+            if isValid(candidate_x, candidate_y):
+                active.append(addPoint(candidate_x, candidate_y))
+                found_point = True
+
+        # Retire the active point once it no longer has room around it
+        if not(found_point):
+            active[active_index] = active[-1]
+            active.pop()
+
+    locations = locations[:number_points[0]].astype(int)
+    if len(locations) > required_points:
+        selected    = random_state.permutation(len(locations))[:required_points]
+        locations   = locations[selected]
+    return locations.tolist()
@@ -0,0 +1,142 @@
+import os
+import hashlib
+import numpy as np
+
+
+
+"""
+The PrecomputedBarMovie class renders every frame of a bar movie once and then
+plays it back by frame index.  It can be used in place of a bar generator
+(e.g. as the bar_movie of a BarStimulus).
+
+The frames are stored as a (frames x width x height) .npy file in a cache
+directory, named by a hash of the generator's parameters, and are opened as a
+read-only memory-map.  The frames are stored in the dtype of the generator's
+screen array, so playback gives exactly the frames the generator would.  The
+screen array of each frame is a view into that memory-map, so no frame is
+copied, and repeated runs (or parallel workers) with the same bar share the
+rendered file instead of re-rendering it.
+
+Inputs:
+    bar_movie - a RuntimeBarGenerator (or AnalyticBarGenerator); it is reset to
+                its starting position and used to render the frames
+    directory - the directory where rendered movies are cached
+
+Methods:
+    update(deltaTime) - this will update the frame if necessary
+    getFrame(frame_index) - the (width x height) intensity array of a frame
+"""
+class PrecomputedBarMovie:
+
+    def __init__(self, bar_movie, directory="Stimulus Cache"):
+        self.bar_movie      = bar_movie
+        self.directory      = directory
+        self.framerate      = bar_movie.framerate
+        self.movie_width    = bar_movie.movie_width
+        self.movie_height   = bar_movie.movie_height
+
+        if not(os.path.exists(self.directory)):
+            os.makedirs(self.directory)
+
+        self.key    = self.buildKey()
+        self.path   = os.path.join(self.directory, self.key + ".npy")
+        if not(os.path.exists(self.path)):
+            self.renderFrames()
+        self.loadFrames()
+
+        # Initialize run timing variables
+        self.time   = 0.0
+        self.frame  = 0
+        self.screen_array = self.getFrame(0)
+
+    def __str__(self):
+        string = str(self.bar_movie)
+        string += "\nPrecomputed Frames\t\t\t"+str(self.number_frames)
+        return string
+
+    """
+    Build the cache key from everything that determines the rendered frames
+    """
+    def buildKey(self):
+        movie = self.bar_movie
+        parameters = [("generator", movie.__class__.__name__),
+                      ("framerate", movie.framerate),
+                      ("movie_size", (movie.movie_width, movie.movie_height)),
+                      ("background_color", tuple(movie.background_color)),
+                      ("bar_orientation", movie.orientation),
+                      ("bar_size", tuple(movie.bar_size)),
+                      ("bar_speed", movie.bar_speed),
+                      ("bar_movement_distance", movie.max_distance),
+                      ("bar_color", tuple(movie.bar_color)),
+                      ("bar_position", tuple(movie.starting_bar_pos)),
+                      ("subpixel_samples", getattr(movie, "subpixel_samples", None)),
+                      ("dtype", str(np.asarray(movie.screen_array).dtype))]
+        return hashlib.sha1(repr(parameters)).hexdigest()
+
+    """
+    Render the frames of the bar movie into the cache.  The bar moves exactly
+    one frame at a time, just like the generator does when it is updated, and
+    the movie ends once the bar has moved its maximum distance.  The number of
+    frames is found first (by moving the bar without drawing it) so that the
+    frames can be written straight into a memory-mapped file.
+    """
+    def renderFrames(self):
+        movie   = self.bar_movie
+        dx      = movie.heading_x * (movie.frame_duration * movie.bar_speed)
+        dy      = movie.heading_y * (movie.frame_duration * movie.bar_speed)
+
+        movie.reset()
+        number_frames = 1
+        while True:
+            movie.moveBar(dx, dy)
+            movie.updateDistanceTraveled()
+            if movie.distance_traveled >= movie.max_distance: break
+            number_frames += 1
+
+        # Write under a temporary name and then rename, so that a partially
+        # rendered movie is never loaded
+        movie.reset()
+        temporary_path  = self.path + ".{0}.tmp".format(os.getpid())
+        frames          = np.lib.format.open_memmap(temporary_path, mode="w+", 
+                                                    dtype=np.asarray(movie.screen_array).dtype,
+                                                    shape=(number_frames, self.movie_width, self.movie_height))
+        frames[0] = movie.screen_array
+        for frame_index in range(1, number_frames):
+            movie.moveBar(dx, dy)
+            movie.drawBar()
+            movie.updateScreenArray()
+            frames[frame_index] = movie.screen_array
+        frames.flush()
+        del frames
+
+        if os.path.exists(self.path): os.remove(self.path)
+        os.rename(temporary_path, self.path)
+        movie.reset()
+
+    def loadFrames(self):
+        self.frames         = np.load(self.path, mmap_mode="r")
+        self.number_frames  = len(self.frames)
+
+    def getFrame(self, frame_index):
+        if self.frames is None: self.loadFrames()
+        return self.frames[min(frame_index, self.number_frames-1)]
+
+    """
+    Given a specified change in world time, show the frame for the new time.
+    Once the movie has run out of frames, the last frame stays on the screen
+    and false is returned; otherwise, return true.
+    """
+    def update(self, timestep):
+        self.time           += timestep
+        self.frame          = int(self.time * self.framerate)
+        self.screen_array   = self.getFrame(self.frame)
+        return self.frame < self.number_frames
+
+    """
+    The memory-map cannot be pickled, so it is closed and only the current
+    frame is kept (the frames are reopened from the cache if needed)
+    """
+    def removeDisplay(self):
+        self.bar_movie.removeDisplay()
+        self.screen_array   = np.array(self.screen_array)
+        self.frames         = None
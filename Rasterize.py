@@ -0,0 +1,95 @@
+"""
+Rasterization of cell geometry into label images
+
+A label image is an integer array of size (height x width) where each pixel
+holds the index of the cell (or compartment) that covers it, or -1 where no
+cell is drawn.  Once a layer has been rasterized, coloring a frame of its
+activity is a single lookup of colors[label_image] instead of drawing every
+cell again.
+
+The cells are drawn with the same pygame calls that draw the layer on screen,
+onto a 32 bit label surface where the "color" of each cell is its index + 1, so
+the label image covers exactly the pixels that the layer's drawActivity would
+(including which cell is on top where cells overlap).
+"""
+
+import numpy as np
+import pygame
+
+
+def createLabelSurface(width, height):
+    surface = pygame.Surface((width, height), 0, 32)
+    surface.fill(0)
+    return surface
+
+"""
+The mapped color that a cell with the given label is drawn with
+"""
+def getLabelColor(label):
+    return int(label) + 1
+
+"""
+Read the (height x width) label image from a label surface
+"""
+def readLabelImage(surface):
+    return pygame.surfarray.array2d(surface).transpose().astype(np.int32) - 1
+
+"""
+Rasterize circles of the same radius centered on integer pixel positions
+"""
+def rasterizeCircles(width, height, centers, radius, labels):
+    surface = createLabelSurface(width, height)
+    for center, label in zip(centers, labels):
+        pygame.draw.circle(surface, getLabelColor(label), center, radius)
+    return readLabelImage(surface)
+
+
+"""
+LabelImageCache class
+
+Keeps the label image of a layer so that drawing a frame of its activity only
+has to copy colors into the covered pixels of a surface.  The label image is
+rebuilt only when the arguments it is built with (the surface size, the scale
+and, for the circular cells, the radius) change.
+"""
+class LabelImageCache(object):
+
+    def __init__(self):
+        self.key            = None
+        self.xs             = None
+        self.ys             = None
+        self.labels         = None
+        self.surface        = None
+
+    """
+    Draw colors (a (number_labels x 3) array) onto the surface, where
+    buildLabelImage(width, height, *arguments) rasterizes the layer
+    """
+    def draw(self, surface, colors, buildLabelImage, *arguments):
+        width, height = surface.get_size()
+        key = (width, height) + arguments
+        if key != self.key:
+            label_image         = buildLabelImage(width, height, *arguments)
+            self.ys, self.xs    = np.nonzero(label_image >= 0)
+            self.labels         = label_image[self.ys, self.xs]
+            self.key            = key
+
+        # Colors can only be written straight into the pixels of 24 and 32 bit
+        # surfaces, so other surfaces (e.g. a 16 bit display surface) are drawn
+        # by copying them to a 32 bit surface, writing the colors there and 
+        # copying the result back
+        if surface.get_bitsize() in [24, 32]:
+            self.writeColors(surface, colors)
+        else:
+            if self.surface == None or self.surface.get_size() != (width, height):
+                self.surface = pygame.Surface((width, height), 0, 32)
+            self.surface.blit(surface, (0, 0))
+            self.writeColors(self.surface, colors)
+            surface.blit(self.surface, (0, 0))
+
+    def writeColors(self, surface, colors):
+        # Surface arrays are indexed (x, y), and the surface stays locked while
+        # the pixel array exists
+        pixels = pygame.surfarray.pixels3d(surface)
+        pixels[self.xs, self.ys] = colors[self.labels]
+        del pixels
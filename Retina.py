@@ -1,4 +1,5 @@
 from time import clock
+from multiprocessing import Pool
 from Constants import *
 
 
@@ -6,9 +7,14 @@ from Constants import *
 Retina class
 """
 class Retina:
-    def __init__(self, retina_width, retina_height, grid_size, timestep, stimulus, display):
+    def __init__(self, retina_width, retina_height, grid_size, timestep, stimulus, display,
+                 random_seed=None):
         self.display = display
         
+        # Random state used to place neurons (a seed makes placement reproducible)
+        self.random_seed    = random_seed
+        self.random_state   = np.random.RandomState(random_seed)
+        
         self.width  = float(retina_width)
         self.height = float(retina_height)
         self.area   = retina_width * retina_height
@@ -19,8 +25,9 @@ class Retina:
         
         self.stimulus = stimulus
         
-        self.time       = 0.0
-        self.timestep   = timestep
+        self.time           = 0.0
+        self.timestep       = timestep
+        self.number_updates = 0
         
         self.history_size = 3
     
@@ -47,6 +54,10 @@ class Retina:
                            self.off_bipolar_activities, self.on_starburst_activities, self.off_starburst_activities]
         self.activity_bounds = [[], [], [], [], [], []]
         
+        # When a recorder is set (see recordActivity), activities are streamed
+        # to disk instead of being kept in the activity lists
+        self.recorder = None
+        
         self.background_color       = pygame.Color(255, 255, 255)
         self.cone_color             = pygame.Color("#FFCF87")
         self.horizontal_color       = pygame.Color("#FFA722")
@@ -57,38 +68,49 @@ class Retina:
         
         self.grid_layers = []
         for depth in range(1):
-            grid = {}
+            grid = SpatialRegistry(self.grid_width, self.grid_height)
             self.grid_layers.append(grid)
                 
         
-    def isPointWithinBounds(self, point):
-        if point.x < 0: return False
-        if point.y < 0: return False
-        if point.x > self.grid_width: return False
-        if point.y > self.grid_height: return False
-        return True      
-    
     def register(self, neuron, compartment, compartment_index, location):
-        if not(self.isPointWithinBounds(location)):
-            return
-            
-        depth   = neuron.layer.layer_depth    
-        key     = location.toIntTuple()
-        if key in self.grid_layers[depth]:
-            self.grid_layers[depth][key].append((neuron, compartment, compartment_index))
-        else:
-            self.grid_layers[depth][key] = [(neuron, compartment, compartment_index)]
+        self.registerLocations(neuron, compartment, compartment_index, [location.toTuple()])
+    
+    """
+    Register a neuron's compartment at an (m x 2) array of grid locations in one
+    batch.  Locations outside of the retina are ignored.
+    """
+    def registerLocations(self, neuron, compartment, compartment_index, locations):
+        locations   = np.asarray(locations, dtype=float).reshape(-1, 2)
+        x, y        = locations[:, 0], locations[:, 1]
+        in_bounds   = (x >= 0) & (y >= 0) & (x <= self.grid_width) & (y <= self.grid_height)
+        
+        depth = neuron.layer.layer_depth
+        self.grid_layers[depth].register((neuron, compartment, compartment_index), locations[in_bounds])
             
     def getOverlappingNeurons(self, neuron, location):
-        key = location.toIntTuple()
-        depth = neuron.layer_depth
-        if key in self.grid_layers[depth]:
-            overlap = []
-            for (other_neuron, other_compartment, other_index) in self.grid_layers[depth][key]:
-                if neuron != other_neuron:
-                    overlap.append((other_neuron, other_compartment, other_index))
-            return overlap 
-        return []
+        overlap = []
+        for entry, count in self.countOverlappingNeurons(neuron, [location.toTuple()]):
+            overlap.extend([entry] * count)
+        return overlap
+    
+    """
+    Find the (neuron, compartment, index) entries, other than the given neuron's,
+    registered at an (m x 2) array of grid locations in one batched query.
+    Returns a list of [entry, count] where count is the number of locations 
+    at which the entry was found, in the order the entries are first found.
+    """
+    def countOverlappingNeurons(self, neuron, locations):
+        grid                        = self.grid_layers[neuron.layer_depth]
+        IDs                         = grid.findIDs(locations)
+        IDs, first_indices, counts  = np.unique(IDs, return_index=True, return_counts=True)
+        order                       = np.argsort(first_indices)
+        
+        overlap = []
+        for ID, count in zip(IDs[order], counts[order]):
+            entry = grid.entries[ID]
+            if neuron != entry[0]:
+                overlap.append([entry, int(count)])
+        return overlap
         
         
     def __str__(self):
@@ -112,10 +134,12 @@ class Retina:
         return string  
        
     """
-    This function saves the current retina object using the Pickle module
+    This function saves the current retina as a snapshot (see RetinaSnapshot)
+    that can be loaded with loadRetinaSnapshot
     """ 
     def saveModel(self, name):
-        import pickle, os
+        import os
+        from RetinaSnapshot import saveRetinaSnapshot
         
         if not(os.path.exists("Saved Retinas")):
             os.mkdir("Saved Retinas")
@@ -134,15 +158,9 @@ class Retina:
         current_path    = os.getcwd()
         save_path       = os.path.join(current_path, directory_name)
         
-        # Create the save file where the retina object will be stored
-        save_file   = os.path.join(save_path, "retina.p")
-        fh          = open(save_file, "wb") 
-        
-        # Unload pygame surface which cannot be handled by pickle
-        self.stimulus.unloadStimulusForSaving()
-        
-        # Pickle the retina!
-        pickle.dump(self, fh)
+        # Store the retina's structure and activities as numpy arrays
+        if self.recorder != None: self.recorder.flush()
+        saveRetinaSnapshot(self, save_path)
         
         parameterPath = os.path.join(save_path, "parameters.txt")
         parameterFile = open(parameterPath, "w")
@@ -150,6 +168,17 @@ class Retina:
         parameterFile.close()
 
 
+    """
+    Stream the activities of future runs to an ActivityRecorder in directory
+    instead of keeping them in memory.  Only the layers named in layer_names
+    (None for all) are written, and only every decimation-th timestep, so the
+    stored activities (see getLayerActivities and loadPast) are then indexed
+    by recorded step: recorded step t is timestep t * decimation of the run.
+    """
+    def recordActivity(self, directory, layer_names=None, decimation=1, chunk_size=64):
+        self.recorder = ActivityRecorder(directory, layer_names, decimation, chunk_size)
+        return self.recorder
+
     """
     This function runs the retina model for a specified duration
     """
@@ -159,6 +188,8 @@ class Retina:
         while self.time <= end_time:
             self.updateActivity()
             self.time += self.timestep
+        
+        if self.recorder != None: self.recorder.flush()
     
         self.findRetinaActivityBounds()
         
@@ -169,13 +200,16 @@ class Retina:
         print self.time
         
         self.stimulus.update(self.timestep) 
+        self.number_updates += 1
         
         for layer_index in range(self.number_layers):
             layer           = self.layers[layer_index]
             if layer != None:
-                activities      = self.activities[layer_index]
-                new_activity    = layer.update()
-                activities.append(new_activity)
+                new_activity = layer.update()
+                if self.recorder != None:
+                    self.recorder.record(self.layer_names[layer_index], new_activity)
+                else:
+                    self.activities[layer_index].append(new_activity)
                 
 #        if self.cone_layer != None:
 #            cone_activity = self.cone_layer.updateActivity()
@@ -209,12 +243,13 @@ class Retina:
         print "Cone Layer Construction Time:", clock() - start_time
         self.layers[0] = self.cone_layer
 
-    def buildHorizontalLayer(self, input_strength, decay_rate, diffusion_radius):
+    def buildHorizontalLayer(self, input_strength, decay_rate, diffusion_radius, diffusion_cutoff=None):
         input_delay = 1
         start_time = clock()
         self.horizontal_layer = HorizontalLayer(self, self.cone_layer, input_delay,
                                                 self.history_size, input_strength,
-                                                decay_rate, diffusion_radius)
+                                                decay_rate, diffusion_radius,
+                                                diffusion_cutoff)
         print "Horizontal Layer Construction Time:", clock() - start_time
         self.layers[1] = self.horizontal_layer
 
@@ -234,9 +269,18 @@ class Retina:
         self.layers[2] = self.on_bipolar_layer
         self.layers[3] = self.off_bipolar_layer
     
+    """
+    Build the On and Off starburst layers.  If number_processes is greater than
+    one, the morphologies of both layers are grown at the same time in a pool
+    of worker processes (the On layer is built while the Off layer's 
+    morphologies are still growing).  The seeds of the morphologies are drawn
+    before anything is grown, so the layers are the same either way.
+    """
     def buildStarburstLayer(self, minimum_distance, minimum_density, 
                             average_wirelength, step_size, 
-                            input_strength, decay_rate, diffusion_width):
+                            input_strength, decay_rate, diffusion_width,
+                            morphology_library=None, number_morphologies=1,
+                            number_processes=1):
         input_delay = 1
         layer_depth = 0
         minimum_distance    /= self.grid_size
@@ -244,18 +288,53 @@ class Retina:
         average_wirelength  /= self.grid_size
         step_size           /= self.grid_size
         start_time = clock()
-        self.on_starburst_layer = StarburstLayer(self, "On", layer_depth, 
-                                                 self.history_size, input_delay, 
-                                                 minimum_distance, minimum_density,
-                                                 average_wirelength, step_size,
-                                                 diffusion_width, decay_rate,
-                                                 input_strength)                                                    
+        
+        on_seeds    = drawMorphologySeeds(self, number_morphologies)
+        off_seeds   = drawMorphologySeeds(self, number_morphologies)
+        
+        on_descriptions     = None
+        off_descriptions    = None
+        pool                = None
+        try:
+            if number_processes > 1:
+                parameters  = getMorphologyParameters(self.history_size, average_wirelength,
+                                                      step_size, diffusion_width)
+                pool        = Pool(number_processes, initializer=initializeGrowthWorker)
+                on_growth   = pool.map_async(growMorphologyDescription, 
+                                             [(self.grid_size, parameters, seed, morphology_library) for seed in on_seeds])
+                off_growth  = pool.map_async(growMorphologyDescription,
+                                             [(self.grid_size, parameters, seed, morphology_library) for seed in off_seeds])
+                pool.close()
+                on_descriptions = on_growth.get()
+            
+            self.on_starburst_layer = StarburstLayer(self, "On", layer_depth, 
+                                                     self.history_size, input_delay, 
+                                                     minimum_distance, minimum_density,
+                                                     average_wirelength, step_size,
+                                                     diffusion_width, decay_rate,
+                                                     input_strength, number_morphologies,
+                                                     morphology_library=morphology_library,
+                                                     morphology_seeds=on_seeds,
+                                                     morphology_descriptions=on_descriptions)
+            
+            if pool != None:
+                off_descriptions = off_growth.get()
+                pool.join()
+        except:
+            # Don't leave the workers running (or hanging) if growing or 
+            # building a layer fails
+            if pool != None: pool.terminate()
+            raise
+            
         self.off_starburst_layer = StarburstLayer(self, "Off", layer_depth, 
                                                  self.history_size, input_delay, 
                                                  minimum_distance, minimum_density,
                                                  average_wirelength, step_size,
                                                  diffusion_width, decay_rate,
-                                                 input_strength)              
+                                                 input_strength, number_morphologies,
+                                                 morphology_library=morphology_library,
+                                                 morphology_seeds=off_seeds,
+                                                 morphology_descriptions=off_descriptions)
         print "On and Off Starburst Layers Construction Time", clock() - start_time
         self.layers[4] = self.on_starburst_layer
         self.layers[5] = self.off_starburst_layer
@@ -266,12 +345,31 @@ class Retina:
     # Visualization Related Methods
     ###########################################################################
     
-    def loadPast(self, timestep):
-        for layer_index in range(self.number_layers):
+    """
+    Get the stored activities of a layer - the recorded activities if a
+    recorder is being used, otherwise the in-memory activity list.  Either way
+    they are indexed by stored step, which is only the timestep of the run if
+    the recorder's decimation is 1.
+    """
+    def getLayerActivities(self, layer_index):
+        if self.recorder != None:
+            return self.recorder.getActivities(self.layer_names[layer_index])
+        return self.activities[layer_index]
+    
+    """
+    Load the stored activities of a timestep into the layers (only into the 
+    layer named layer_name if it is given, e.g. the layer being drawn).  The
+    timestep indexes the stored activities, so with a decimated recorder it 
+    is the recorded step (see recordActivity).
+    """
+    def loadPast(self, timestep, layer_name=None):
+        layer_indices = range(self.number_layers)
+        if layer_name != None: layer_indices = [self.layer_names.index(layer_name)]
+        for layer_index in layer_indices:
             layer       = self.layers[layer_index]
-            activities  = self.activities[layer_index]
             if layer != None:
-                layer.loadPast(activities[timestep])       
+                activities = self.getLayerActivities(layer_index)
+                if activities is not None: layer.loadPast(activities[timestep])       
     
     def drawLayerActivity(self, surface, layer_name, colormap, scale=1.0):
         if layer_name != None:
@@ -286,7 +384,11 @@ class Retina:
             activities  = self.activities[layer_index]
             layer_name  = self.layer_names[layer_index]
             if layer != None:
-                bounds = self.findActivityBounds(activities, -1, 1, True)
+                if self.recorder != None:
+                    min_activity, max_activity = self.recorder.getBounds(layer_name)
+                    bounds = self.imposeActivityBounds(min_activity, max_activity, -1, 1, True)
+                else:
+                    bounds = self.findActivityBounds(activities, -1, 1, True)
                 self.activity_bounds[layer_index] = bounds
                 print "{0} Activity Bounds: ({1:.3f}, {2:.3f})".format(layer_name, bounds[0], bounds[1])
         
@@ -295,7 +397,11 @@ class Retina:
         max_activity = np.amax(activities)
         min_activity = np.amin(activities)
         print "Activity Bounds: ({0:.3f}, {1:.3f})".format(min_activity, max_activity)
-        
+        return self.imposeActivityBounds(min_activity, max_activity, estimated_min, 
+                                         estimated_max, activity_centered_on_zero)
+    
+    def imposeActivityBounds(self, min_activity, max_activity, estimated_min, estimated_max, 
+                             activity_centered_on_zero):
         # Impose an estimated max/min
         max_activity    = max(max_activity, estimated_max)
         min_activity    = min(min_activity, estimated_min)
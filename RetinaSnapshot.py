@@ -0,0 +1,415 @@
+"""
+Retina snapshots
+
+A snapshot saves a retina as a directory of typed numpy arrays instead of
+pickling the whole object graph (every Vector2D, compartment and point along
+with the activity history).  The snapshot holds:
+
+    metadata.p - a small pickled dictionary of plain python values (the
+                 construction parameters of the retina, stimulus and layers,
+                 the activity bounds and the small parts of the morphology
+                 descriptions)
+    structure.npz - the neuron locations, the morphology each starburst uses,
+                    the geometry and the (large) distance and diffusion arrays
+                    of each starburst morphology, the connections of the 
+                    layers (as dense arrays or as the data, indices and indptr
+                    arrays of sparse CSR matrices) and the histories of each
+                    layer
+    <layer name>.npy - the (timesteps x 1 x neurons) activities of a layer
+
+Loading rebuilds the retina from the stored locations, morphologies and 
+connections, so no neurons are placed, no morphologies are grown and no
+connections are searched for again (the stimulus is rebuilt with the same
+geometry, so the cones' inputs still apply).  The saved activities are opened
+as read-only memory-maps, so they are only read from disk as they are used.
+
+A loaded retina can also be run further: the histories of its layers are
+restored, the stimulus is advanced to where it was when the retina was saved
+and the activity of each layer is kept in a list (of the memory-mapped saved
+activities, one per timestep) that new activities are appended to.
+"""
+
+import os
+import pickle
+from time import clock
+from scipy import sparse
+from Constants import *
+
+
+"""
+The keys of the morphology description arrays that are stored in structure.npz
+rather than in the metadata
+"""
+MORPHOLOGY_ARRAYS = ["distance_steps", "diffusion_weights"]
+
+"""
+The names that the layers of a retina (in the order of retina.layers) are 
+stored under
+"""
+LAYER_KEYS = ["cone", "horizontal", "on_bipolar", "off_bipolar", "on_starburst", "off_starburst"]
+
+
+"""
+Save a retina as a snapshot in directory (which must already exist)
+"""
+def saveRetinaSnapshot(retina, directory):
+    arrays      = {}
+    metadata    = {}
+
+    metadata["retina"] = {"retina_width"    : retina.width,
+                          "retina_height"   : retina.height,
+                          "grid_size"       : retina.grid_size,
+                          "timestep"        : retina.timestep,
+                          "random_seed"     : retina.random_seed,
+                          "random_state"    : retina.random_state.get_state(),
+                          "time"            : retina.time,
+                          "number_updates"  : retina.number_updates,
+                          "history_size"    : retina.history_size,
+                          "activity_bounds" : retina.activity_bounds}
+    metadata["stimulus"] = describeStimulus(retina.stimulus)
+
+    if retina.cone_layer != None:
+        layer = retina.cone_layer
+        metadata["cone_layer"] = {"nearest_neighbor_distance"   : layer.nearest_neighbor_distance,
+                                  "minimum_required_density"    : layer.minimum_required_density,
+                                  "input_field_radius"          : layer.input_field_radius}
+        arrays["cone_locations"] = np.array(layer.locations, dtype=np.int64).reshape(-1, 2)
+        saveSparseMatrix(arrays, "cone_input_weights", layer.input_weights)
+
+    if retina.horizontal_layer != None:
+        layer = retina.horizontal_layer
+        metadata["horizontal_layer"] = {"input_delay"       : layer.input_delay,
+                                        "input_strength"    : layer.input_strength,
+                                        "decay_rate"        : layer.decay_rate,
+                                        "diffusion_width"   : layer.diffusion_width,
+                                        "diffusion_cutoff"  : layer.diffusion_cutoff}
+        if sparse.issparse(layer.lateral_weights):
+            saveSparseMatrix(arrays, "horizontal_lateral_weights", layer.lateral_weights)
+        else:
+            arrays["horizontal_lateral_weights"] = np.asarray(layer.lateral_weights)
+
+    for name, layer in [["on_bipolar", retina.on_bipolar_layer], ["off_bipolar", retina.off_bipolar_layer]]:
+        if layer == None: continue
+        metadata[name + "_layer"] = {"input_delay"                  : layer.input_delay,
+                                     "layer_depth"                  : layer.layer_depth,
+                                     "nearest_neighbor_distance"    : layer.nearest_neighbor_distance,
+                                     "minimum_required_density"     : layer.minimum_required_density,
+                                     "input_field_radius"           : layer.input_field_radius,
+                                     "output_field_radius"          : layer.output_field_radius}
+        arrays[name + "_locations"] = np.array(layer.locations, dtype=np.int64).reshape(-1, 2)
+        saveSparseMatrix(arrays, name + "_input_weights", layer.input_weights)
+
+    for name, layer in [["on_starburst", retina.on_starburst_layer], ["off_starburst", retina.off_starburst_layer]]:
+        if layer == None: continue
+        descriptions = []
+        for morphology_index in range(len(layer.morphologies)):
+            description = layer.morphologies[morphology_index].describe()
+            prefix      = "{0}_morphology_{1}_".format(name, morphology_index)
+            for key in MORPHOLOGY_ARRAYS:
+                arrays[prefix + key] = description.pop(key)
+            descriptions.append(packMorphologyGeometry(description, arrays, prefix))
+
+        # The overlaps of the starbursts with each of their input layers
+        input_layers = []
+        for input_layer, overlaps in layer.getInputOverlaps():
+            input_key = LAYER_KEYS[retina.layers.index(input_layer)]
+            saveSparseMatrix(arrays, "{0}_input_overlaps_{1}".format(name, input_key), overlaps)
+            input_layers.append(input_key)
+
+        metadata[name + "_layer"] = {"layer_depth"                  : layer.layer_depth,
+                                     "input_delay"                  : layer.input_delay,
+                                     "nearest_neighbor_distance"    : layer.nearest_neighbor_distance,
+                                     "minimum_required_density"     : layer.minimum_required_density,
+                                     "average_wirelength"           : layer.average_wirelength,
+                                     "step_size"                    : layer.step_size,
+                                     "diffusion_width"              : layer.diffusion_width,
+                                     "decay_rate"                   : layer.decay_rate,
+                                     "input_strength"               : layer.input_strength,
+                                     "morphology_seeds"             : layer.morphology_seeds,
+                                     "morphology_descriptions"      : descriptions,
+                                     "input_layers"                 : input_layers}
+        arrays[name + "_locations"]             = np.array([location.toTuple() for location in layer.locations]).reshape(-1, 2)
+        arrays[name + "_morphology_indices"]    = np.array([layer.morphologies.index(neuron.morphology) for neuron in layer.neurons],
+                                                           dtype=np.int64)
+
+    # The histories that the layers' next updates are calculated from
+    for layer_key, layer in zip(LAYER_KEYS, retina.layers):
+        if layer == None: continue
+        for history_key, history in getLayerHistories(layer).iteritems():
+            arrays["{0}_{1}".format(layer_key, history_key)] = history.toArray()
+        if isinstance(layer, BipolarLayer):
+            metadata[layer_key + "_layer"]["number_updates"] = layer.number_updates
+
+    np.savez(os.path.join(directory, "structure.npz"), **arrays)
+
+    # Each layer's activities are stored in their own .npy file so that they
+    # can be memory-mapped when they are loaded
+    metadata["activity_steps"] = {}
+    for layer_index in range(retina.number_layers):
+        if retina.layers[layer_index] == None: continue
+        layer_name  = retina.layer_names[layer_index]
+        activities  = retina.getLayerActivities(layer_index)
+        if activities is None: continue
+        activities  = np.asarray(activities, dtype=np.float64)
+        np.save(os.path.join(directory, layer_name + ".npy"), activities)
+        metadata["activity_steps"][layer_name] = len(activities)
+
+    fh = open(os.path.join(directory, "metadata.p"), "wb")
+    pickle.dump(metadata, fh, pickle.HIGHEST_PROTOCOL)
+    fh.close()
+
+"""
+Store a sparse matrix under key as the data, indices and indptr arrays (and the
+shape) of its CSR form
+"""
+def saveSparseMatrix(arrays, key, matrix):
+    matrix                      = sparse.csr_matrix(matrix)
+    arrays[key + "_data"]       = matrix.data
+    arrays[key + "_indices"]    = matrix.indices
+    arrays[key + "_indptr"]     = matrix.indptr
+    arrays[key + "_shape"]      = np.array(matrix.shape, dtype=np.int64)
+
+def loadSparseMatrix(arrays, key):
+    return sparse.csr_matrix((arrays[key + "_data"], arrays[key + "_indices"], arrays[key + "_indptr"]),
+                             shape=tuple(arrays[key + "_shape"]))
+
+"""
+Store a list of variable length lists as one concatenated array under key and
+the offsets of each list in it under key_offsets
+"""
+def packLists(arrays, key, lists, dtype, shape=(-1,)):
+    lengths                     = [len(values) for values in lists]
+    arrays[key + "_offsets"]    = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+    arrays[key]                 = np.array([value for values in lists for value in values], dtype=dtype).reshape(shape)
+
+def unpackLists(arrays, key):
+    values  = arrays[key].tolist()
+    offsets = arrays[key + "_offsets"].tolist()
+    return [values[offsets[i]:offsets[i+1]] for i in range(len(offsets) - 1)]
+
+"""
+Move the geometry of a morphology description (the dendrites, the line points,
+neighbors and gridded locations of the compartments and the properties of the
+points) into typed arrays, stored under prefix.  Returns what is left of the 
+description, which only holds small python values.
+"""
+def packMorphologyGeometry(description, arrays, prefix):
+    dendrites = description.pop("dendrites")
+    packLists(arrays, prefix + "dendrite_locations", [dendrite[0] for dendrite in dendrites], float, (-1, 2))
+    packLists(arrays, prefix + "dendrite_children", [dendrite[1] for dendrite in dendrites], np.int64)
+    arrays[prefix + "dendrite_headings"]            = np.array([dendrite[2] for dendrite in dendrites], dtype=float)
+    arrays[prefix + "dendrite_master_branch_IDs"]   = np.array([dendrite[3] for dendrite in dendrites], dtype=np.int64)
+
+    compartments = description.pop("compartments")
+    packLists(arrays, prefix + "compartment_line_points", [compartment[0] for compartment in compartments], float, (-1, 2))
+    packLists(arrays, prefix + "compartment_proximal_neighbors", [compartment[1] for compartment in compartments], np.int64)
+    packLists(arrays, prefix + "compartment_distal_neighbors", [compartment[2] for compartment in compartments], np.int64)
+    packLists(arrays, prefix + "compartment_gridded_locations", [compartment[3] for compartment in compartments], np.int64, (-1, 2))
+    description["compartment_synapses"] = [[compartment[4], compartment[5]] for compartment in compartments]
+
+    # The neurotransmitters each point accepts and releases are stored as
+    # (points x neurotransmitters) masks
+    points              = description.pop("points")
+    neurotransmitters   = set()
+    for compartment_index, wirelength, accepted, released in points:
+        neurotransmitters |= accepted | released
+    neurotransmitters   = sorted(neurotransmitters)
+    arrays[prefix + "point_compartments"]   = np.array([point[0] for point in points], dtype=np.int64)
+    arrays[prefix + "point_wirelengths"]    = np.array([point[1] for point in points], dtype=float)
+    arrays[prefix + "point_accepted"]       = np.array([[nt in point[2] for nt in neurotransmitters] for point in points],
+                                                       dtype=bool).reshape(len(points), len(neurotransmitters))
+    arrays[prefix + "point_released"]       = np.array([[nt in point[3] for nt in neurotransmitters] for point in points],
+                                                       dtype=bool).reshape(len(points), len(neurotransmitters))
+    description["point_neurotransmitters"] = neurotransmitters
+    return description
+
+"""
+Rebuild the geometry of a morphology description stored by 
+packMorphologyGeometry
+"""
+def unpackMorphologyGeometry(description, arrays, prefix):
+    description = dict(description)
+    description["dendrites"] = zip(unpackLists(arrays, prefix + "dendrite_locations"),
+                                   unpackLists(arrays, prefix + "dendrite_children"),
+                                   arrays[prefix + "dendrite_headings"].tolist(),
+                                   arrays[prefix + "dendrite_master_branch_IDs"].tolist())
+
+    synapses = description.pop("compartment_synapses")
+    description["compartments"] = zip(unpackLists(arrays, prefix + "compartment_line_points"),
+                                      unpackLists(arrays, prefix + "compartment_proximal_neighbors"),
+                                      unpackLists(arrays, prefix + "compartment_distal_neighbors"),
+                                      unpackLists(arrays, prefix + "compartment_gridded_locations"),
+                                      [inputs for inputs, outputs in synapses],
+                                      [outputs for inputs, outputs in synapses])
+
+    neurotransmitters   = description.pop("point_neurotransmitters")
+    accepted_masks      = arrays[prefix + "point_accepted"].tolist()
+    released_masks      = arrays[prefix + "point_released"].tolist()
+    description["points"] = []
+    for compartment_index, wirelength, accepted, released in zip(arrays[prefix + "point_compartments"].tolist(),
+                                                                 arrays[prefix + "point_wirelengths"].tolist(),
+                                                                 accepted_masks, released_masks):
+        description["points"].append([compartment_index, wirelength,
+                                      set(nt for nt, mask in zip(neurotransmitters, accepted) if mask),
+                                      set(nt for nt, mask in zip(neurotransmitters, released) if mask)])
+    return description
+
+"""
+The histories of a layer that its updates are calculated from
+"""
+def getLayerHistories(layer):
+    histories = {"activities" : layer.activities}
+    if isinstance(layer, BipolarLayer):
+        histories["neurotransmitter_history"] = layer.neurotransmitter_history
+    return histories
+
+"""
+The parameters needed to rebuild a bar stimulus
+"""
+def describeStimulus(stimulus):
+    bar_movie       = stimulus.bar_movie
+    precomputed     = isinstance(bar_movie, PrecomputedBarMovie)
+    cache_directory = None
+    if precomputed:
+        cache_directory = bar_movie.directory
+        bar_movie       = bar_movie.bar_movie
+
+    generator = {"framerate"                : bar_movie.framerate,
+                 "movie_size"               : (bar_movie.movie_width, bar_movie.movie_height),
+                 "background_color"         : tuple(bar_movie.background_color),
+                 "bar_orientation"          : bar_movie.orientation,
+                 "bar_size"                 : tuple(bar_movie.bar_size),
+                 "bar_speed"                : bar_movie.bar_speed,
+                 "bar_movement_distance"    : bar_movie.max_distance,
+                 "bar_color"                : tuple(bar_movie.bar_color),
+                 "bar_position"             : tuple(bar_movie.starting_bar_pos),
+                 "subpixel_samples"         : getattr(bar_movie, "subpixel_samples", 1)}
+    return {"position_on_retina"    : stimulus.position_on_retina,
+            "pixel_size"            : stimulus.pixel_size,
+            "generator"             : generator,
+            "cache_directory"       : cache_directory}
+
+"""
+Rebuild a bar stimulus.  The bar is always rebuilt with an AnalyticBarGenerator
+so that loading a snapshot does not need a display.
+"""
+def loadStimulus(stimulus_description):
+    bar_movie = AnalyticBarGenerator(**stimulus_description["generator"])
+    if stimulus_description["cache_directory"] != None:
+        bar_movie = PrecomputedBarMovie(bar_movie, stimulus_description["cache_directory"])
+    return BarStimulus(position_on_retina=stimulus_description["position_on_retina"],
+                       pixel_size=stimulus_description["pixel_size"], bar_movie=bar_movie)
+
+
+"""
+Load a retina from the snapshot in directory
+"""
+def loadRetinaSnapshot(directory, display=None):
+    start_time = clock()
+
+    fh          = open(os.path.join(directory, "metadata.p"), "rb")
+    metadata    = pickle.load(fh)
+    fh.close()
+    arrays      = np.load(os.path.join(directory, "structure.npz"))
+
+    parameters  = metadata["retina"]
+    stimulus    = loadStimulus(metadata["stimulus"])
+    retina      = Retina(parameters["retina_width"], parameters["retina_height"],
+                         parameters["grid_size"], parameters["timestep"], stimulus, display,
+                         random_seed=parameters["random_seed"])
+    retina.time         = parameters["time"]
+    retina.history_size = parameters["history_size"]
+    history_size        = retina.history_size
+
+    if "cone_layer" in metadata:
+        parameters = metadata["cone_layer"]
+        retina.cone_layer = ConeLayer(retina, parameters["nearest_neighbor_distance"],
+                                      parameters["minimum_required_density"],
+                                      parameters["input_field_radius"], history_size, stimulus,
+                                      locations=arrays["cone_locations"].tolist(),
+                                      input_weights=loadSparseMatrix(arrays, "cone_input_weights"))
+        retina.layers[0] = retina.cone_layer
+
+    if "horizontal_layer" in metadata:
+        parameters = metadata["horizontal_layer"]
+        if "horizontal_lateral_weights" in arrays:  lateral_weights = arrays["horizontal_lateral_weights"]
+        else:                                       lateral_weights = loadSparseMatrix(arrays, "horizontal_lateral_weights")
+        retina.horizontal_layer = HorizontalLayer(retina, retina.cone_layer, parameters["input_delay"],
+                                                  history_size, parameters["input_strength"],
+                                                  parameters["decay_rate"], parameters["diffusion_width"],
+                                                  parameters["diffusion_cutoff"], lateral_weights)
+        retina.layers[1] = retina.horizontal_layer
+
+    for name, bipolar_type, layer_index in [["on_bipolar", "On", 2], ["off_bipolar", "Off", 3]]:
+        if name + "_layer" not in metadata: continue
+        parameters  = metadata[name + "_layer"]
+        layer       = BipolarLayer(retina, bipolar_type, retina.cone_layer, retina.horizontal_layer,
+                                   history_size, parameters["input_delay"], parameters["layer_depth"],
+                                   parameters["nearest_neighbor_distance"],
+                                   parameters["minimum_required_density"],
+                                   parameters["input_field_radius"], parameters["output_field_radius"],
+                                   locations=arrays[name + "_locations"].tolist(),
+                                   input_weights=loadSparseMatrix(arrays, name + "_input_weights"))
+        setattr(retina, name + "_layer", layer)
+        retina.layers[layer_index] = layer
+
+    for name, starburst_type, layer_index in [["on_starburst", "On", 4], ["off_starburst", "Off", 5]]:
+        if name + "_layer" not in metadata: continue
+        parameters      = metadata[name + "_layer"]
+        descriptions    = []
+        for morphology_index in range(len(parameters["morphology_descriptions"])):
+            prefix      = "{0}_morphology_{1}_".format(name, morphology_index)
+            description = unpackMorphologyGeometry(parameters["morphology_descriptions"][morphology_index],
+                                                   arrays, prefix)
+            for key in MORPHOLOGY_ARRAYS:
+                description[key] = arrays[prefix + key]
+            descriptions.append(description)
+
+        input_overlaps = []
+        for input_key in parameters["input_layers"]:
+            overlaps = loadSparseMatrix(arrays, "{0}_input_overlaps_{1}".format(name, input_key))
+            input_overlaps.append([getattr(retina, input_key + "_layer"), overlaps])
+
+        locations = [Vector2D(x, y) for x, y in arrays[name + "_locations"].tolist()]
+        layer = StarburstLayer(retina, starburst_type, parameters["layer_depth"], history_size,
+                               parameters["input_delay"], parameters["nearest_neighbor_distance"],
+                               parameters["minimum_required_density"],
+                               parameters["average_wirelength"], parameters["step_size"],
+                               parameters["diffusion_width"], parameters["decay_rate"],
+                               parameters["input_strength"], len(descriptions),
+                               morphology_seeds=parameters["morphology_seeds"],
+                               morphology_descriptions=descriptions, locations=locations,
+                               morphology_indices=arrays[name + "_morphology_indices"].tolist(),
+                               input_overlaps=input_overlaps)
+        setattr(retina, name + "_layer", layer)
+        retina.layers[layer_index] = layer
+
+    # Restore the histories of the layers so they continue where they stopped
+    for layer_key, layer in zip(LAYER_KEYS, retina.layers):
+        if layer == None: continue
+        for history_key, history in getLayerHistories(layer).iteritems():
+            history.loadArray(arrays["{0}_{1}".format(layer_key, history_key)])
+        if isinstance(layer, BipolarLayer):
+            layer.number_updates = metadata[layer_key + "_layer"]["number_updates"]
+
+    # The stimulus is rebuilt at its start, so replay its updates
+    retina.number_updates = metadata["retina"]["number_updates"]
+    for update in range(retina.number_updates):
+        stimulus.update(retina.timestep)
+
+    # Open the activities as memory-maps (an empty file cannot be mapped).  Each
+    # layer's activities are a list of the memory-mapped timesteps, so that 
+    # running the loaded retina can append to it.
+    for layer_name, number_steps in metadata["activity_steps"].iteritems():
+        path        = os.path.join(directory, layer_name + ".npy")
+        mmap_mode   = "r" if number_steps > 0 else None
+        retina.activities[retina.layer_names.index(layer_name)] = list(np.load(path, mmap_mode=mmap_mode))
+    retina.cone_activities, retina.horizontal_activities, retina.on_bipolar_activities, \
+        retina.off_bipolar_activities, retina.on_starburst_activities, \
+        retina.off_starburst_activities = retina.activities
+
+    retina.activity_bounds = metadata["retina"]["activity_bounds"]
+    retina.random_state.set_state(metadata["retina"]["random_state"])
+
+    print "Retina Snapshot Load Time:", clock() - start_time
+    return retina
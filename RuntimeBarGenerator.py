@@ -56,20 +56,12 @@ class RuntimeBarGenerator:
         self.distance_traveled      = 0.0
         self.max_distance           = bar_movement_distance
 
-        # Initialize the pygame module
-        pygame.init()
-
-        # Create a pygame display surface
-        self.display = pygame.display.set_mode(movie_size)
-        self.drawBar()
-
         # Initialize run timing variables
         self.time   = 0.0
         self.frame  = 0
 
-        # Initialize the numpy array representing the screen
-        self.screen_array = pygame.surfarray.pixels3d(self.display)
-
+        # Create the screen and the numpy array representing it
+        self.initializeScreen()
         self.drawBar()
         self.updateScreenArray()
 
@@ -85,6 +77,24 @@ class RuntimeBarGenerator:
         string += "\nMovement Distance\t\t\t"+str(self.max_distance)
         return string
     
+    """
+    Create the pygame display surface that the bar is drawn on
+    """
+    def initializeScreen(self):
+        pygame.init()
+        self.display = pygame.display.set_mode((self.movie_width, self.movie_height))
+    
+    """
+    Move the bar back to its starting position and restart the movie timing
+    """
+    def reset(self):
+        self.time               = 0.0
+        self.frame              = 0
+        self.distance_traveled  = 0.0
+        self.initBarVertices(self.bar_size[0], self.bar_size[1], self.orientation, self.starting_bar_pos)
+        self.drawBar()
+        self.updateScreenArray()
+    
     """
     Create a list of bar vertices, [ul, ur, lr, ll], defining a rotated
     rectangle centered on a position
@@ -0,0 +1,144 @@
+"""
+SpatialRegistry class
+
+Keeps track of which neuron compartments occupy each cell of the retinal grid.
+Each registered (neuron, compartment, compartment_index) entry is given an
+integer ID, and the occupancy is stored in CSR-style arrays:
+    cell_IDs[cell_offsets[cell]:cell_offsets[cell+1]] are the IDs in that cell
+where cell = x * (grid_height + 1) + y for the integer grid location (x, y).
+
+Registration is batched: locations are appended to pending arrays, which are
+sorted into a small side table that queries check along with the CSR arrays.
+The pending registrations are only merged into the CSR arrays once there are
+as many of them as there are registered locations, so alternating registers
+and queries does not rebuild the whole registry each time.
+
+Methods:
+    register(entry, locations) - register an entry at an (m x 2) array of locations
+    findIDs(locations) - IDs of the entries at an (m x 2) array of locations
+"""
+
+import numpy as np
+
+class SpatialRegistry(object):
+
+    def __init__(self, grid_width, grid_height):
+        self.grid_width     = grid_width
+        self.grid_height    = grid_height
+        self.number_cells   = (grid_width + 1) * (grid_height + 1)
+
+        self.entries = []
+
+        self.pending_cells  = []
+        self.pending_IDs    = []
+        self.pending_size   = 0
+
+        # The pending registrations sorted by cell (None until they are sorted)
+        self.side_cells     = None
+        self.side_IDs       = None
+
+        self.cell_offsets   = np.zeros(self.number_cells + 1, dtype=np.int64)
+        self.cell_IDs       = np.zeros(0, dtype=np.int32)
+
+    """
+    Convert an (m x 2) array of locations into integer grid cells.  Locations
+    are truncated like Vector2D.toIntTuple.  Returns the cells and a mask of
+    the locations that fall on the grid.
+    """
+    def locationsToCells(self, locations):
+        locations   = np.asarray(locations, dtype=float).reshape(-1, 2)
+        int_x       = locations[:, 0].astype(np.int64)
+        int_y       = locations[:, 1].astype(np.int64)
+        on_grid     = (int_x >= 0) & (int_y >= 0) & (int_x <= self.grid_width) & (int_y <= self.grid_height)
+        cells       = int_x * (self.grid_height + 1) + int_y
+        return cells, on_grid
+
+    """
+    Register an entry at each of the locations (which should already be within
+    the bounds of the grid).  Returns the entry's ID.
+    """
+    def register(self, entry, locations):
+        ID = len(self.entries)
+        self.entries.append(entry)
+
+        cells, on_grid = self.locationsToCells(locations)
+        cells = cells[on_grid]
+        self.pending_cells.append(cells)
+        self.pending_IDs.append(np.zeros(len(cells), dtype=np.int32) + ID)
+        self.pending_size   += len(cells)
+        self.side_cells     = None
+        self.side_IDs       = None
+        return ID
+
+    """
+    Merge the pending registrations into the CSR arrays.  A stable sort keeps
+    the IDs within a cell in the order that they were registered.
+    """
+    def build(self):
+        if self.pending_cells == []: return
+
+        old_cells   = np.repeat(np.arange(self.number_cells), np.diff(self.cell_offsets))
+        cells       = np.concatenate([old_cells] + self.pending_cells)
+        IDs         = np.concatenate([self.cell_IDs] + self.pending_IDs)
+
+        order               = np.argsort(cells, kind="mergesort")
+        self.cell_IDs       = IDs[order]
+        cell_counts         = np.bincount(cells, minlength=self.number_cells)
+        self.cell_offsets   = np.concatenate(([0], np.cumsum(cell_counts)))
+
+        self.pending_cells  = []
+        self.pending_IDs    = []
+        self.pending_size   = 0
+        self.side_cells     = None
+        self.side_IDs       = None
+
+    """
+    Sort the pending registrations by cell into the side table (again, a stable
+    sort keeps the IDs within a cell in the order that they were registered)
+    """
+    def buildSideTable(self):
+        if self.side_cells is not None: return
+        cells           = np.concatenate([np.zeros(0, dtype=np.int64)] + self.pending_cells)
+        IDs             = np.concatenate([np.zeros(0, dtype=np.int32)] + self.pending_IDs)
+        order           = np.argsort(cells, kind="mergesort")
+        self.side_cells = cells[order]
+        self.side_IDs   = IDs[order]
+
+    """
+    Find the IDs of the entries registered at each of the locations.  An ID is
+    repeated once for each location where it was registered.  The IDs are
+    returned location by location, and within a location in the order that 
+    they were registered.
+    """
+    def findIDs(self, locations):
+        if self.pending_size > len(self.cell_IDs): self.build()
+
+        cells, on_grid  = self.locationsToCells(locations)
+        cells           = cells[on_grid]
+        starts          = self.cell_offsets[cells]
+        lengths         = self.cell_offsets[cells + 1] - starts
+        IDs             = self.cell_IDs[gatherSlices(starts, lengths)]
+        if self.pending_size == 0: return IDs
+
+        # Registrations that have not been merged yet come from the side table,
+        # after the IDs found in the CSR arrays for the same location (a stable
+        # sort by location keeps that order)
+        self.buildSideTable()
+        side_starts     = np.searchsorted(self.side_cells, cells, side="left")
+        side_lengths    = np.searchsorted(self.side_cells, cells, side="right") - side_starts
+        side_IDs        = self.side_IDs[gatherSlices(side_starts, side_lengths)]
+
+        location_indices    = np.arange(len(cells))
+        keys                = np.concatenate((np.repeat(location_indices, lengths),
+                                              np.repeat(location_indices, side_lengths)))
+        order               = np.argsort(keys, kind="mergesort")
+        return np.concatenate((IDs, side_IDs))[order]
+
+
+"""
+Indices of the slices [start, start+length) of an array, concatenated
+"""
+def gatherSlices(starts, lengths):
+    total_length    = np.sum(lengths)
+    slice_starts    = np.cumsum(lengths) - lengths
+    return np.repeat(starts - slice_starts, lengths) + np.arange(total_length)
@@ -1,3 +1,4 @@
+from scipy import sparse
 from Constants import *
 
 class Starburst(object):
@@ -20,18 +21,18 @@ class Starburst(object):
         self.decay_rate             = layer.decay_rate
         self.diffusion_weights      = self.morphology.diffusion_weights
         
-        self.activities = []
+        # The activity history is a view into the layer's packed HistoryBuffer
+        # and is assigned by the layer once all of its starbursts exist
+        self.activities = None
+        
         self.neurotransmitter_ouputs = []
         for i in range(self.history_size):
-            blank_activity = np.zeros((1, self.number_compartments))
-            self.activities.append(blank_activity)
-            
             self.neurotransmitter_ouputs.append([])
             for c in range(self.number_compartments):
                 self.neurotransmitter_ouputs[-1].append({})
         
-    def loadPast(self, activity):
-        self.activities[0] = activity
+    def getNeurotransmitterOutputs(self, history_index, compartment_index):
+        return self.neurotransmitter_ouputs[history_index][compartment_index]
         
     def drawInputs(self, surface, selected_compartment, scale=1.0):
         for (info, weight) in self.compartment_inputs[selected_compartment]:
@@ -55,20 +56,144 @@ class Starburst(object):
                                      activities, scale=scale, 
                                      new_location=self.location)
     
+    """
+    Find the inputs to each compartment and count the number of points where
+    each input overlaps the compartment.  The overlaps of all of a compartment's
+    points are found with one query to the retina and counted in a dictionary
+    (the same input can be registered with the retina more than once).
+    """
     def establishInputs(self):
         self.compartment_inputs = []        
         for compartment in self.compartments:
-            self.compartment_inputs.append([])
-            for location in compartment.gridded_locations:
-                location = location + self.location
-                for neuron, compartment, compartment_index in self.retina.getOverlappingNeurons(self, location):
-                    if self.isAppropriateInput(neuron, compartment):
-                        booleans = [(neuron, compartment, compartment_index) == i[0] for i in self.compartment_inputs[-1]]
-                        if any(booleans):
-                            index = booleans.index(True)
-                            self.compartment_inputs[-1][index][1] += 1
-                        else:
-                            self.compartment_inputs[-1].append([(neuron, compartment, compartment_index), 1.0])
+            locations = [location.toTuple() for location in compartment.gridded_locations]
+            locations = np.array(locations, dtype=float).reshape(-1, 2) + self.location.toTuple()
+            
+            inputs          = []
+            input_indices   = {}
+            for key, count in self.retina.countOverlappingNeurons(self, locations):
+                neuron, other_compartment, compartment_index = key
+                if self.isAppropriateInput(neuron, other_compartment):
+                    if key in input_indices:
+                        inputs[input_indices[key]][1] += count
+                    else:
+                        input_indices[key] = len(inputs)
+                        inputs.append([key, float(count)])
+            self.compartment_inputs.append(inputs)
+        
+        self.compileInputs()
+    
+    """
+    Compile compartment_inputs into one sparse (compartments x source neurons)
+    matrix of the points of overlap for each source layer, input_overlaps, and
+    compile those into the input matrices.
+    """
+    def compileInputs(self):
+        # (compartment, source neuron, points overlap) triplets for each source
+        # layer.  Bipolar inputs have a single compartment, so the source 
+        # column is the bipolar's index within its layer.
+        triplets = {}
+        for compartment_index in range(self.number_compartments):
+            for [other_neuron, other_compartment, other_index], points_overlap in self.compartment_inputs[compartment_index]:
+                layer = other_neuron.layer
+                if layer not in triplets: triplets[layer] = [[], [], []]
+                rows, cols, values = triplets[layer]
+                rows.append(compartment_index)
+                cols.append(other_neuron.index)
+                values.append(points_overlap)
+        
+        self.input_overlaps = []
+        for layer, (rows, cols, values) in triplets.iteritems():
+            overlaps = sparse.csr_matrix((values, (rows, cols)), 
+                                         shape=(self.number_compartments, layer.number_neurons))
+            self.input_overlaps.append([layer, overlaps])
+        
+        self.compileInputMatrices()
+    
+    """
+    Use [source layer, overlaps] pairs, like input_overlaps, that were found
+    before (e.g. stored in a saved snapshot) instead of finding the inputs with
+    the retina.  compartment_inputs is rebuilt from the overlaps.
+    """
+    def loadInputs(self, input_overlaps):
+        self.input_overlaps     = input_overlaps
+        self.compartment_inputs = [[] for compartment_index in range(self.number_compartments)]
+        for layer, overlaps in input_overlaps:
+            overlaps = overlaps.tocoo()
+            for compartment_index, neuron_index, points_overlap in zip(overlaps.row.tolist(), overlaps.col.tolist(),
+                                                                       overlaps.data.tolist()):
+                other_neuron    = layer.neurons[neuron_index]
+                key             = (other_neuron, other_neuron.compartments[0], 0)
+                self.compartment_inputs[compartment_index].append([key, points_overlap])
+        
+        self.compileInputMatrices()
+    
+    """
+    Compile input_overlaps into one sparse (compartments x source neurons)
+    matrix for each (source layer, neurotransmitter) pair.  The points of
+    overlap and the normalization by the maximum amount of neurotransmitter
+    each compartment could receive are folded into the matrix, so the
+    normalized neurotransmitter input is a single sparse product.  Also stores
+    the input weight of each neurotransmitter for each compartment along with
+    a mask of the compartments that both accept and receive it.  Every neuron
+    of a source layer releases the same neurotransmitters (the bipolars of a 
+    layer share their compartment).
+    """
+    def compileInputMatrices(self):
+        # The max nt input for each compartment
+        nt_maxes = {}
+        for layer, overlaps in self.input_overlaps:
+            points_overlap = np.asarray(overlaps.sum(1)).ravel()
+            for nt, nt_weight in layer.compartment.neurotransmitters_output_weights.iteritems():
+                if nt not in nt_maxes: nt_maxes[nt] = np.zeros(self.number_compartments)
+                nt_maxes[nt] += nt_weight * points_overlap
+        
+        self.input_matrices = []
+        for layer, overlaps in self.input_overlaps:
+            rows = np.repeat(np.arange(self.number_compartments), np.diff(overlaps.indptr))
+            for nt in layer.compartment.neurotransmitters_output_weights:
+                matrix = sparse.csr_matrix((overlaps.data / nt_maxes[nt][rows], overlaps.indices, overlaps.indptr),
+                                           shape=overlaps.shape)
+                self.input_matrices.append([layer, nt, matrix])
+        
+        self.input_nt_weights   = {}
+        self.input_nt_masks     = {}
+        for nt in nt_maxes:
+            weights = np.zeros(self.number_compartments)
+            for compartment_index in range(self.number_compartments):
+                compartment = self.compartments[compartment_index]
+                if nt in compartment.neurotransmitters_input_weights:
+                    weights[compartment_index] = compartment.neurotransmitters_input_weights[nt]
+            self.input_nt_weights[nt]   = weights
+            self.input_nt_masks[nt]     = (weights != 0) & (nt_maxes[nt] > 0)
+    
+    """
+    Find the input potential of each compartment from the neurotransmitters
+    released by its inputs.  Each compartment's potential is the average over
+    the neurotransmitters it accepts and receives.  Layers that have not
+    released a neurotransmitter yet (e.g. at the start of a run) contribute 
+    nothing.
+    """
+    def calculateInputActivity(self):
+        nt_inputs = {}
+        for layer, nt, matrix in self.input_matrices:
+            layer_nt_outputs = layer.getNeurotransmitterOutputs(self.input_delay)
+            if nt in layer_nt_outputs:
+                nt_input = matrix.dot(layer_nt_outputs[nt][0])
+                if nt in nt_inputs: nt_inputs[nt] += nt_input
+                else:               nt_inputs[nt] = nt_input
+        
+        total_potentials    = np.zeros(self.number_compartments)
+        number_potentials   = np.zeros(self.number_compartments)
+        for nt, nt_input in nt_inputs.iteritems():
+            mask        = self.input_nt_masks[nt]
+            potentials  = self.layer.neurotransmittersToPotentials(self.input_nt_weights[nt] * nt_input)
+            total_potentials[mask]  += potentials[mask]
+            number_potentials[mask] += 1.0
+        
+        input_activity  = np.zeros((1, self.number_compartments))
+        has_potentials  = number_potentials > 0
+        input_activity[0, has_potentials] = total_potentials[has_potentials] / number_potentials[has_potentials]
+        return input_activity
                         
     def isAppropriateInput(self, neuron, compartment):
         if isinstance(neuron, Bipolar) and neuron.layer.bipolar_type == self.starburst_type:
@@ -81,11 +206,38 @@ class Starburst(object):
             compartment.registerWithRetina(self, compartment_index)
     
 
-    def update(self):
-        # Delete the oldest activity and get the current activity
-        del self.activities[-1]
-        last_activity = self.activities[0]
+    """
+    Update the compartment activities.  The layer advances the shared history
+    before updating its neurons, so the last activity is one step ago and the
+    new activity is written into the current step.  The layer diffuses all
+    starbursts that share a morphology at once and passes in the result; if it
+    is not given, this starburst's diffusion is calculated on its own.
+    """
+    def update(self, diffusion_activity=None):
+        if diffusion_activity is None:
+            diffusion_activity = self.calculateDiffusion(self.activities[1])
+
+        input_activity = self.calculateInputActivity()
+
+        # Calcualte the new activity
+        d = self.decay_rate
+        i = self.input_strength
+        new_activity = i * input_activity + (1.0-i) * (1.0-d) * diffusion_activity
+        
         
+#        np.set_printoptions(precision=3, suppress=True, linewidth=300)
+#        print diffusion_activity
+#        print input_activity
+#        print new_activity
+            
+        # Store the most recent activity at the front of the history
+        self.activities[0] = new_activity
+        return self.activities[0]
+
+    """
+    Perform one step of diffusion between the compartments of this starburst
+    """
+    def calculateDiffusion(self, last_activity):
         # Create the activity difference matrix where:
         #   Dij = compartment i activity - compartment j activity
         #   This matrix describes the concentration gradient
@@ -115,46 +267,4 @@ class Starburst(object):
         # np.sum removes a dimension, so let's restore it.
         diffusion_activity.shape = (1, self.number_compartments) 
         
-        
-        input_activity = np.zeros((1, self.number_compartments))    
-        for compartment_index in range(self.number_compartments):
-            compartment = self.compartments[compartment_index]
-            inputs      = self.compartment_inputs[compartment_index]
-            
-            input_potential = 0.0
-            nt_inputs   = {}
-            nt_maxes    = {}
-            for [other_neuron, other_compartment, other_index], points_overlap in inputs: 
-                other_nt_outputs = other_neuron.neurotransmitter_ouputs[self.input_delay][other_index]
-                for nt, nt_amount in other_nt_outputs.iteritems():
-                    # This might be hacked and may need to be re-evaluated
-                    # Normalzing by the max amount of input nt I could have recieved
-                    # Only works when nt amounts scale between 0 and 1
-                    if nt in nt_inputs:
-                        nt_inputs[nt]   += nt_amount * points_overlap
-                        nt_maxes[nt]    += other_compartment.neurotransmitters_output_weights[nt] * points_overlap
-                    else:
-                        nt_inputs[nt]   = nt_amount * points_overlap
-                        nt_maxes[nt]    = other_compartment.neurotransmitters_output_weights[nt] * points_overlap
-            for nt in nt_inputs:
-                nt_inputs[nt] /= nt_maxes[nt]
-            input_potential = compartment.calculatePotentialFromNeurotransmitterInputs(self, nt_inputs)
-             
-            input_activity[0, compartment_index] = input_potential
-            
-            
-        
-        # Calcualte the new activity
-        d = self.decay_rate
-        i = self.input_strength
-        new_activity = i * input_activity + (1.0-i) * (1.0-d) * diffusion_activity
-        
-        
-#        np.set_printoptions(precision=3, suppress=True, linewidth=300)
-#        print diffusion_activity
-#        print input_activity
-#        print new_activity
-            
-        # Add the most recent activity to the front of the list
-        self.activities.insert(0, new_activity)
-        return new_activity
\ No newline at end of file
+        return diffusion_activity
\ No newline at end of file
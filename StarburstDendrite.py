@@ -2,7 +2,6 @@ import numpy as np
 import pygame
 from copy import deepcopy
 from pygame.locals import *
-from random import random, uniform, randint
 from math import atan2
 from DendritePoint import DendritePoint
 from Compartment import GrowingCompartment
@@ -34,10 +33,19 @@ class DendriteSegment:
         
 #        self.color = (randint(100,255),randint(100,255),randint(100,255))
         self.color = (0,0,0)
+        self.is_registered = False
         
+    """
+    Add the dendrite to the neuron's list of dendrites and add its line
+    segments to the neuron's segment hash, so that other dendrites will avoid 
+    them.  Children take their first step before they are registered.
+    """
     def registerDendriteWithNeuron(self):
         self.index = len(self.neuron.dendrites)
         self.neuron.dendrites.append(self)
+        self.is_registered = True
+        for segment_index in range(len(self.circle_bounds)):
+            self.neuron.registerSegment(self, segment_index)
         
 
     def createCopy(self, new_starburst, parent_dendrite=None):
@@ -172,7 +180,7 @@ class DendriteSegment:
         
 
         # Okay, you didn't die or procreate, so you can grow.
-        self.heading = generateRandomInAllowableRanges(allowable_range)
+        self.heading = generateRandomInAllowableRanges(allowable_range, self.neuron.random)
         vector_direction = Vector2D.generateHeadingFromAngle(self.heading)
         old_location = self.locations[-1] 
         new_location = old_location + vector_direction * self.step_size
@@ -187,6 +195,8 @@ class DendriteSegment:
         radius = distance/2.0
         center = (old_location+new_location)/2.0
         self.circle_bounds.append([radius, center])
+        if self.is_registered:
+            self.neuron.registerSegment(self, len(self.circle_bounds)-1)
         
         return self.is_growing, []
         
@@ -214,82 +224,77 @@ class DendriteSegment:
         # Find my allowed heading ranges (based on my ability to turn as defined by heading_deviation)
         allowable_headings = calculateHeadingRange(heading, heading_deviation)        
         
-        # For each dendrite in the neuron
-        for other in self.neuron.dendrites:
+        # For each line segment of the neuron's dendrites that could be within 
+        # my visual range (visited in the order of the neuron's dendrites)
+        search_radius = vision_radius + self.step_size/2.0
+        for other, i in self.neuron.findNearbySegments(vision_center, search_radius):
             
-            number_other_locations = len(other.locations)
+            # If the other neuron is myself, then do not check the last line 
+            # segment because it will not cause a collision conflict
+            if other == self and i > len(other.locations) - 3: continue
             
-            # If the other neuron is myself, then do not check the last pair of 
-            # points because they will not cause a collision conflict
-            start_index = 0
-            if other == self:   end_index = number_other_locations - 3
-            else:               end_index = number_other_locations - 2
-                        
-            # Loop through all the line segments that make up the other dendrite
-            for i in range(start_index, end_index+1): 
+            # Get the circular bounding box that contains the line segment
+            line_segment_radius = other.circle_bounds[i][0]
+            line_segment_center = other.circle_bounds[i][1]
+            
+            # Check if circular bounding box defined by the other line
+            # segment intersects with bounding box defined by my visual range                
+            collision_circle_distance   = vision_radius + line_segment_radius
+            distance_between_circles    = vision_center.distanceTo(line_segment_center)
+            if distance_between_circles <= collision_circle_distance:
                 
-                # Get the circular bounding box that contains the line segment
-                line_segment_radius = other.circle_bounds[i][0]
-                line_segment_center = other.circle_bounds[i][1]
+                # Now find the angle from myself to each of the line segment endpoints
+                a = other.locations[i]
+                b = other.locations[i+1]
                 
-                # Check if circular bounding box defined by the other line
-                # segment intersects with bounding box defined by my visual range                
-                collision_circle_distance   = vision_radius + line_segment_radius
-                distance_between_circles    = vision_center.distanceTo(line_segment_center)
-                if distance_between_circles <= collision_circle_distance:
-                    
-                    # Now find the angle from myself to each of the line segment endpoints
-                    a = other.locations[i]
-                    b = other.locations[i+1]
-                    
-                    # CAVEAT: If one of my points is also one of the line segment
-                    # endpoints, then the atan2 will return 0 which will throw off
-                    # the range of exluded angles.
-                    # WORKAROUND: Hacky, but just use the midpoint of the line
-                    # segment.
-                    if a == vision_center: a = line_segment_center
-                    if b == vision_center: b = line_segment_center
-                    
-                    # Calculate the angles (angleHeadingTo returns an angle from 0-360)
-                    angle_to_a = vision_center.angleHeadingTo(a)
-                    angle_to_b = vision_center.angleHeadingTo(b)
-                    
-                    # Find the range
-                    if angle_to_a > angle_to_b: 
-                        angle_max, angle_min  = angle_to_a, angle_to_b
-                    else:
-                        angle_min, angle_max  = angle_to_a, angle_to_b
-                    
-                    # Find the set(s) that define the exlusion bounds
-                    if (angle_max - angle_min) > 180:
-                        # The unwrapping process can create discontinuities in the heading range
-                        #   If the original range was (10 to -10), the unwrapped range is (10 to 350)
-                        #   This is really two ranges [0 to 10] and [350, 360]
-                        angles = [[0.0, angle_min], [angle_max, 360.0]]
-                    else:
-                        angles = [[angle_min, angle_max]]
-                    
-                    # Check each set of exluded angles against each set of allowable
-                    # headings.  If there is any overlap, remove the exluded angles
-                    # from the allowable headings list
-                    for angle_min, angle_max in angles:
-                        angle_in_range = False
-                        for heading_min, heading_max in allowable_headings:
-                            if heading_min <= angle_min and angle_min <= heading_max:
-                                angle_in_range = True
-                                break
-                            if heading_min <= angle_max and angle_max <= heading_max:
-                                angle_in_range = True
-                                break
-                            if angle_min <= heading_min and heading_min <= angle_max:
-                                angle_in_range = True
-                                break
-                            if angle_min <= heading_max and heading_max <= angle_max:
-                                angle_in_range = True
-                                break
-                        if angle_in_range: 
-                            allowable_headings = excludeRange(allowable_headings, [angle_min, angle_max])
-                            
+                # CAVEAT: If one of my points is also one of the line segment
+                # endpoints, then the atan2 will return 0 which will throw off
+                # the range of exluded angles.
+                # WORKAROUND: Hacky, but just use the midpoint of the line
+                # segment.
+                if a == vision_center: a = line_segment_center
+                if b == vision_center: b = line_segment_center
+                
+                # Calculate the angles (angleHeadingTo returns an angle from 0-360)
+                angle_to_a = vision_center.angleHeadingTo(a)
+                angle_to_b = vision_center.angleHeadingTo(b)
+                
+                # Find the range
+                if angle_to_a > angle_to_b: 
+                    angle_max, angle_min  = angle_to_a, angle_to_b
+                else:
+                    angle_min, angle_max  = angle_to_a, angle_to_b
+                
+                # Find the set(s) that define the exlusion bounds
+                if (angle_max - angle_min) > 180:
+                    # The unwrapping process can create discontinuities in the heading range
+                    #   If the original range was (10 to -10), the unwrapped range is (10 to 350)
+                    #   This is really two ranges [0 to 10] and [350, 360]
+                    angles = [[0.0, angle_min], [angle_max, 360.0]]
+                else:
+                    angles = [[angle_min, angle_max]]
+                
+                # Check each set of exluded angles against each set of allowable
+                # headings.  If there is any overlap, remove the exluded angles
+                # from the allowable headings list
+                for angle_min, angle_max in angles:
+                    angle_in_range = False
+                    for heading_min, heading_max in allowable_headings:
+                        if heading_min <= angle_min and angle_min <= heading_max:
+                            angle_in_range = True
+                            break
+                        if heading_min <= angle_max and angle_max <= heading_max:
+                            angle_in_range = True
+                            break
+                        if angle_min <= heading_min and heading_min <= angle_max:
+                            angle_in_range = True
+                            break
+                        if angle_min <= heading_max and heading_max <= angle_max:
+                            angle_in_range = True
+                            break
+                    if angle_in_range: 
+                        allowable_headings = excludeRange(allowable_headings, [angle_min, angle_max])
+                        
         return allowable_headings
     
     
@@ -302,7 +307,7 @@ class DendriteSegment:
         # but this check has already been performed
         
         # Find the probability of branching based on your current segment length
-        random_number           = random()
+        random_number           = self.neuron.random.random()
         probability_threshold   = self.neuron.branchProbability(self.length)
         
         # The odds aren't in your favor...
@@ -494,16 +499,17 @@ def excludeRange(allowableRanges, excludeRange):
 
 """
 Given a list of continuous [min, max] ranges of headings (allowableRanges), pick
-a value from within the combined ranges given.
+a value from within the combined ranges given using a random number generator
+(the random module or a random.Random instance).
 """
-def generateRandomInAllowableRanges(allowableRanges):
+def generateRandomInAllowableRanges(allowableRanges, random_generator):
     # Find the total degrees spanned from the combination of all ranges
     totalAngle = 0.0
     for i in allowableRanges:
         totalAngle += i[1] - i[0]
         
     # Generate a random degree from 0 to that total degree
-    rand = uniform(0, totalAngle)
+    rand = random_generator.uniform(0, totalAngle)
     
     # Loop back through the input ranges and find where that randomly 
     # generate degree "lives"
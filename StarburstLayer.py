@@ -1,15 +1,23 @@
-from random import randint, choice
 from time import clock
-import math as m
+from scipy import sparse
 from Constants import *
 
 
+"""
+The largest number of (cells x compartments x compartments) values that are
+diffused at once
+"""
+DIFFUSION_BLOCK_SIZE = 2**20
+
+
 class StarburstLayer:
     
     def __init__(self, retina, starburst_type, layer_depth, history_size,
                  input_delay, nearest_neighbor_distance, minimum_required_density,
                  average_wirelength, step_size, diffusion_width, decay_rate, 
-                 input_strength, number_morphologies=1, visualize_growth=False, display=None):
+                 input_strength, number_morphologies=1, visualize_growth=False, display=None,
+                 morphology_library=None, morphology_seeds=None, morphology_descriptions=None,
+                 locations=None, morphology_indices=None, input_overlaps=None):
                      
         self.retina             = retina
         self.starburst_type     = starburst_type
@@ -19,46 +27,115 @@ class StarburstLayer:
         self.diffusion_width    = diffusion_width
         self.decay_rate         = decay_rate
         self.input_strength     = input_strength
+        self.average_wirelength = average_wirelength
+        self.step_size          = step_size
     
-        # Generate unique morphologies
+        # Generate unique morphologies (or load them from the morphology
+        # library).  Each morphology is grown from a seed, which is drawn from 
+        # the retina's random state if the seeds are not given.  If the 
+        # morphologies have already been grown (e.g. in a process pool), their
+        # descriptions can be passed in instead.
+        if morphology_seeds == None:
+            morphology_seeds = drawMorphologySeeds(retina, number_morphologies)
+        if morphology_descriptions == None:
+            morphology_descriptions = [None] * len(morphology_seeds)
+        self.morphology_seeds = morphology_seeds
+        morphology_parameters = getMorphologyParameters(history_size, average_wirelength,
+                                                        step_size, diffusion_width)
+        
         self.morphologies = []
-        for i in range(number_morphologies):
-            morphology = StarburstMorphology(retina, history_size=history_size,
-                                             diffusion_width=diffusion_width,
-                                             average_wirelength=average_wirelength,
-                                             step_size=step_size,
-                                             visualize_growth=visualize_growth,
-                                             display=display)
+        for random_seed, description in zip(morphology_seeds, morphology_descriptions):
+            morphology = StarburstMorphology(retina, visualize_growth=visualize_growth,
+                                             display=display, random_seed=random_seed,
+                                             morphology_library=morphology_library,
+                                             description=description,
+                                             **morphology_parameters)
             self.morphologies.append(morphology)    
         
-        # Generate soma locations
+        # Generate soma locations (unless they are given, e.g. by a saved snapshot)
         self.nearest_neighbor_distance  = nearest_neighbor_distance
         self.minimum_required_density   = minimum_required_density
         self.minimum_required_cells     = int(minimum_required_density * (retina.area/retina.density_area))
-        self.placeNeurons()
+        if locations == None:   self.placeNeurons()
+        else:                   self.locations = locations
         self.number_neurons = len(self.locations)
         
-        # Instantiate starbursts
+        # Instantiate starbursts (the morphology of each starburst can be given
+        # as an index into the morphologies)
         self.neurons = []
         for i in range(self.number_neurons):
 #            location    = self.locations[i]
             location = Vector2D(200.0, 200.0)
-            morphology  = choice(self.morphologies)
+            if morphology_indices == None:  morphology_index = self.retina.random_state.randint(len(self.morphologies))
+            else:                           morphology_index = morphology_indices[i]
+            morphology  = self.morphologies[morphology_index]
             starburst   = Starburst(self, morphology, location, starburst_type, input_delay, layer_depth)
             self.neurons.append(starburst)
+        
+        self.initializeActivities()
+        self.label_image_cache = LabelImageCache()
     
         self.inputs = {}
         
-        self.establishInputs()
+        # The overlaps of the starbursts with their inputs can be given (e.g. by
+        # a saved snapshot) instead of finding them with the retina
+        if input_overlaps is None:  self.establishInputs()
+        else:                       self.loadInputs(input_overlaps)
+    
+    """
+    Pack the compartments of all starbursts into one contiguous history of
+    size (history_size x total compartments).  The starbursts are grouped by
+    morphology so that the columns of cells sharing a morphology form one block
+    that can be viewed as a (cells x compartments) matrix.  Each starburst gets
+    a view of its own columns, given by neuron.column_range.
+    """
+    def initializeActivities(self):
+        self.morphology_groups = []
+        offset = 0
+        for morphology in self.morphologies:
+            group_neurons = [neuron for neuron in self.neurons if neuron.morphology is morphology]
+            if group_neurons == []: continue
+            
+            group_start = offset
+            for neuron in group_neurons:
+                neuron.column_range = (offset, offset + neuron.number_compartments)
+                offset += neuron.number_compartments
+            self.morphology_groups.append([morphology, len(group_neurons), group_start, offset])
+        self.number_compartments = offset
+        
+        self.activities = HistoryBuffer(self.history_size, self.number_compartments)
+        for neuron in self.neurons:
+            start, stop = neuron.column_range
+            neuron.activities = self.activities.view(start, stop)
     
     def loadPast(self, activity):
-        for neuron_index in range(self.number_neurons):
-            neuron = self.neurons[neuron_index]
-            neuron.loadPast(activity[neuron_index])
+        self.activities[0] = activity
                   
+    """
+    Draw the compartments of the starbursts in the colors of their current
+    activities.  The compartments are rasterized into a label image once for
+    each scale, so no compartment quads are rebuilt when a frame is drawn.
+    """
     def drawActivity(self, surface, colormap, activity_bounds, scale=1.0):
+        colors = getColormapLUT(colormap).getColors(self.activities[0][0])
+        self.label_image_cache.draw(surface, colors, self.buildLabelImage, scale)
+        
+    """
+    Rasterize the compartments of the starbursts, as drawn by drawActivity, 
+    into a (height x width) label image of each compartment's column in the
+    layer's activities
+    """
+    def buildLabelImage(self, width, height, scale=1.0):
+        surface = createLabelSurface(width, height)
         for neuron in self.neurons:
-            neuron.drawActivity(surface, colormap, activity_bounds, scale=scale)
+            start, stop = neuron.column_range
+            for compartment_index in range(neuron.number_compartments):
+                compartment = neuron.compartments[compartment_index]
+                a           = (neuron.location + compartment.line_points[0]) * scale
+                b           = (neuron.location + compartment.line_points[1]) * scale
+                vertices    = compartment.buildQuadFromLine(a, b, scale)
+                pygame.draw.polygon(surface, getLabelColor(start + compartment_index), vertices)
+        return readLabelImage(surface)
         
     def draw(self, surface, color=None, scale=1.0):
         if color==None: 
@@ -67,16 +144,90 @@ class StarburstLayer:
         for neuron in self.neurons:
             neuron.draw(surface, color=color, scale=scale, draw_compartments=True)
             
+    """
+    Advance the shared history and update each starburst's columns in place.
+    Returns a copy of the (1 x total compartments) activity since the history's
+    memory is reused on later timesteps.
+    """
     def update(self):
-        layer_activity = []
+        self.activities.advance()
+        diffusion_activity = self.calculateDiffusion(self.activities[1])
         for neuron in self.neurons:
-            neuron_activity = neuron.update()
-            layer_activity.append(neuron_activity)
-        return layer_activity 
+            start, stop = neuron.column_range
+            neuron.update(diffusion_activity[:, start:stop])
+        return self.activities[0].copy()
+    
+    """
+    Perform one step of diffusion for every starburst in the layer.  This is the
+    same calculation as Starburst.calculateDiffusion, but the cells that share a
+    morphology (and therefore diffusion weights) are stacked into a (cells x
+    compartments) matrix and diffused together.  The cells are diffused in
+    blocks of at most DIFFUSION_BLOCK_SIZE values of (cells x compartments x
+    compartments), so the memory used does not grow with the number of cells.
+    """
+    def calculateDiffusion(self, last_activity):
+        diffusion_activity = np.zeros(last_activity.shape)
+        for morphology, number_cells, start, stop in self.morphology_groups:
+            activities          = last_activity[0, start:stop].reshape(number_cells, -1)
+            group_activity      = np.zeros(activities.shape)
+            number_compartments = activities.shape[1]
+            block_cells         = max(DIFFUSION_BLOCK_SIZE / number_compartments**2, 1)
+            
+            for block_start in range(0, number_cells, block_cells):
+                block_activities = activities[block_start:block_start+block_cells]
+                
+                # Dcij = cell c's compartment i activity - compartment j activity
+                differences = block_activities[:, :, np.newaxis] - block_activities[:, np.newaxis, :]
+                differences *= morphology.diffusion_weights
+                differences[differences < 0] = 0
+                
+                # Subtract what each compartment sends out and add what it receives
+                self_activities = block_activities - np.sum(differences, 2)
+                group_activity[block_start:block_start+block_cells] = np.sum(differences, 1) + self_activities
+            
+            diffusion_activity[0, start:stop] = group_activity.ravel()
+        return diffusion_activity
     
     def establishInputs(self):
         for neuron in self.neurons:
             neuron.establishInputs()
+    
+    """
+    Get the overlaps of the starbursts with their inputs as [source layer,
+    overlaps] pairs, where overlaps stacks the (compartments x source neurons)
+    input_overlaps of the starbursts into one sparse matrix in the order of
+    the neurons
+    """
+    def getInputOverlaps(self):
+        layers = []
+        for neuron in self.neurons:
+            for layer, overlaps in neuron.input_overlaps:
+                if layer not in layers: layers.append(layer)
+        
+        input_overlaps = []
+        for layer in layers:
+            blocks = []
+            for neuron in self.neurons:
+                block = sparse.csr_matrix((neuron.number_compartments, layer.number_neurons))
+                for other_layer, overlaps in neuron.input_overlaps:
+                    if other_layer is layer: block = overlaps
+                blocks.append(block)
+            input_overlaps.append([layer, sparse.vstack(blocks, format="csr")])
+        return input_overlaps
+    
+    """
+    Load the inputs of the starbursts from overlaps stacked by getInputOverlaps
+    """
+    def loadInputs(self, input_overlaps):
+        start = 0
+        for neuron in self.neurons:
+            stop            = start + neuron.number_compartments
+            neuron_overlaps = []
+            for layer, overlaps in input_overlaps:
+                overlaps = overlaps[start:stop]
+                if overlaps.nnz > 0: neuron_overlaps.append([layer, overlaps])
+            neuron.loadInputs(neuron_overlaps)
+            start = stop
 
     def inputWeightingFunction(self, inputs):
         pass
@@ -85,6 +236,8 @@ class StarburstLayer:
         if nt < 0: return -1.0
         if nt > 1: return 1.0
         return (nt*2.0)-1.0
+    def neurotransmittersToPotentials(self, nts):
+        return np.clip((nts*2.0)-1.0, -1.0, 1.0)
     def potentialToNeurotransmitter(self, pt):
         if pt < -1: return 0.0
         if pt > 1: return 1.0
@@ -92,71 +245,17 @@ class StarburstLayer:
         
     """
     Nearest neighbor distance constrained placement of points
-        The method involves tracking point locations and tracking exclusion zones around those points
-        Random points are generated until:
-            A valid point is found (one that is within the bounds and not located within an exclusion zone
-            A maximum number of tries has been exhausted
-    """
-    def placeNeurons(self, max_rand_tries=1000):
-        # Set the bounds on the positions
-        xmin = 0
-        ymin = 0
-        xmax = self.retina.grid_width
-        ymax = self.retina.grid_height
-
-        # Convert the minimum distance from world units to grid units
-        gridded_distance        = self.nearest_neighbor_distance
-        ceil_gridded_distance   = int(m.ceil(gridded_distance))
-        
-        # Calculate the number of cells to place
-        required_cells = self.minimum_required_cells
-        current_cells  = 0
-
-        # Create empty sets to hold the selected positions and the excluded positions
-        excluded_positions = set()
-        self.locations = []
-
-        while current_cells < required_cells:
-
-            # Pick a random point
-            x = randint(xmin, xmax)
-            y = randint(ymin, ymax)
-            p = Vector2D(x, y)
-            p_ID = p.toTuple()
-            
-            # Regenerate random point until a valid point is found
-            rand_tries = 0
-            while p_ID in excluded_positions:
-                x = randint(xmin, xmax)
-                y = randint(ymin, ymax)
-                p = Vector2D(x, y)
-                p_ID = p.toTuple()
-                
-                rand_tries += 1
-                if rand_tries > max_rand_tries: break
-
-            # If too many attempts were made to generate a new point, exit loop
-            if rand_tries > max_rand_tries: break    
-
-            # Update the sets with the newly selected point
-            excluded_positions.add(p_ID)
-            self.locations.append(p)
-
-            # Find the bounding box of excluded coordinates surrounding the new point
-            left    = max(x - ceil_gridded_distance, xmin)
-            right   = min(x + ceil_gridded_distance, xmax)
-            up      = max(y - ceil_gridded_distance, ymin)
-            down    = min(y + ceil_gridded_distance, ymax)
-
-            # Check if each point in the bounding box is within the minimum distance radius
-            # If so, add it to the exclusion set
-            for x2 in range(left, right+1):
-                for y2 in range(up, down+1):
-                    p2 = Vector2D(x2, y2)
-                    if p.distanceTo(p2) < gridded_distance:
-                        excluded_positions.add(p2.toTuple())
-
-            current_cells += 1
+        Points are placed with a Poisson-disk sampler so that no two neurons
+        are closer than the nearest neighbor distance.  The random numbers come
+        from the retina's random state, so placement can be seeded.
+    """
+    def placeNeurons(self):
+        locations = poissonDiskPlacement(0, self.retina.grid_width,
+                                         0, self.retina.grid_height,
+                                         self.nearest_neighbor_distance,
+                                         self.minimum_required_cells,
+                                         self.retina.random_state)
+        self.locations = [Vector2D(x, y) for x, y in locations]
 
         
     def __str__(self):
@@ -166,4 +265,21 @@ class StarburstLayer:
         string += "\nMinimum Required Density (cells/mm^2)\t{0}".format(self.minimum_required_density)
         string += "\nNumber of Neurons\t\t\t{0}".format(self.neurons)
         string += "\nInput Delay (timesteps)\t\t\t{0}".format(self.input_delay)
-        return string
\ No newline at end of file
+        return string
+        
+        
+        
+"""
+Draw the seeds used to grow a layer's morphologies from the retina's random state
+"""
+def drawMorphologySeeds(retina, number_morphologies):
+    return [int(seed) for seed in retina.random_state.randint(2**31 - 1, size=number_morphologies)]
+
+"""
+The StarburstMorphology arguments used by a starburst layer
+"""
+def getMorphologyParameters(history_size, average_wirelength, step_size, diffusion_width):
+    return {"history_size"          : history_size,
+            "average_wirelength"    : average_wirelength,
+            "step_size"             : step_size,
+            "diffusion_width"       : diffusion_width}
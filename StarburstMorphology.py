@@ -1,5 +1,7 @@
-from random import uniform, randint, shuffle, choice
-from igraph import Graph, ADJ_UNDIRECTED
+import random
+import signal
+import math as m
+from scipy import sparse
 import matplotlib.pyplot as plt
 from Constants import *
 
@@ -11,7 +13,7 @@ class StarburstMorphology(object):
                  step_size=15, max_segment_length=35*UM_TO_M, children_deviation=20, 
                  dendrite_vision_radius=30*UM_TO_M, diffusion_width=15*UM_TO_M,
                  color_palette=GOLDFISH, draw_location=Vector2D(0.0,0.0), visualize_growth=False, scale=1.0,
-                 display=None):
+                 display=None, random_seed=None, morphology_library=None, description=None):
         
         # General neuron variables
         self.retina             = retina
@@ -39,17 +41,71 @@ class StarburstMorphology(object):
         self.step_size              = step_size
         self.max_segment_length     = max_segment_length / grid_size
         self.dendrite_vision_radius = dendrite_vision_radius / grid_size
-        
+        self.children_deviation     = children_deviation
+        self.diffusion_width        = diffusion_width
+        
+        # Spatial hash of the line segments of the dendrites.  Segments are
+        # filed under the cell that holds their center.  Cells are as wide as
+        # the distance at which a dendrite could see a segment, so a dendrite
+        # only needs to look in the 3x3 cells around it.
+        self.segment_cell_size  = self.dendrite_vision_radius + self.step_size/2.0
+        self.segment_grid       = {}
+        
+        # Random number generator used for growth - seeding it makes the 
+        # morphology reproducible (and lets it be stored in a library)
+        self.random_seed = random_seed
+        if random_seed == None: self.random = random
+        else:                   self.random = random.Random(random_seed)
+        
+        # The arguments that determine the morphology (used as a library key)
+        self.parameters = [("history_size", history_size), 
+                           ("location", location.toTuple()),
+                           ("average_wirelength", average_wirelength),
+                           ("radius_deviation", radius_deviation),
+                           ("min_branches", min_branches),
+                           ("max_branches", max_branches),
+                           ("heading_deviation", heading_deviation),
+                           ("step_size", step_size),
+                           ("max_segment_length", max_segment_length),
+                           ("children_deviation", children_deviation),
+                           ("dendrite_vision_radius", dendrite_vision_radius),
+                           ("diffusion_width", diffusion_width),
+                           ("grid_size", grid_size)]
+        
+        # Rebuild the morphology from a description if one was given (e.g. it
+        # was grown in another process), otherwise load it from the library if
+        # it has already been grown or grow it
+        library_key = None
+        if description == None and morphology_library != None and random_seed != None:
+            library_key = morphology_library.buildKey(self.parameters, random_seed)
+            description = morphology_library.load(library_key)
+        
+        if description != None:
+            self.loadDescription(description)
+        else:
+            self.buildMorphology(min_branches, max_branches, min_wirelength, max_wirelength)
+            if library_key != None:
+                morphology_library.save(library_key, self.describe())
+        
+        # Color the dendrites and compartments
+        self.colorDendrites(color_palette[1:])  
+        self.colorCompartments(color_palette[1:])
+    
+    """
+    Grow the dendrites, break them into compartments and establish the 
+    synapses and diffusion weights of the compartments
+    """
+    def buildMorphology(self, min_branches, max_branches, min_wirelength, max_wirelength):
         # Initialize the first branches
-        number_dendrites    = randint(min_branches, max_branches)
+        number_dendrites    = self.random.randint(min_branches, max_branches)
         heading_spacing     = 360.0 / number_dendrites
         heading             = 0.0
         
         self.dendrites = []
         for i in range(number_dendrites):
-            wirelength = uniform(min_wirelength, max_wirelength)
+            wirelength = self.random.uniform(min_wirelength, max_wirelength)
             dendrite = DendriteSegment(self, self.location, heading, wirelength, wirelength,
-                                       children_deviation, self.dendrite_vision_radius, i)
+                                       self.children_deviation, self.dendrite_vision_radius, i)
             dendrite.registerDendriteWithNeuron()                                                                       
             heading += heading_spacing
         
@@ -58,23 +114,104 @@ class StarburstMorphology(object):
         self.master_dendrites           = self.dendrites[:]  
         self.number_master_dendrites    = len(self.master_dendrites)
         
-        # Grow and color the dendrites
+        # Grow the dendrites
         self.grow()              
         self.number_dendrites = len(self.dendrites)        
-        self.colorDendrites(color_palette[1:])  
         
         # Build compartments (this assumes compartments are line segments)
         self.compartmentalizeLineSegments()
         self.buildLineSegmentShortestPaths()
-        self.colorCompartments(color_palette[1:])
         self.discretizeCompartments(1.0)
         self.createPointsOnCompartments()
         self.establishPointSynapses()
         self.establishCompartmentSynapses()
         
         # Establish variables needed for activity
-        self.diffusion_width    = diffusion_width
         self.establisthLineSegmentDiffusionWeights()
+    
+    """
+    Create a compact description of the grown morphology that only contains
+    plain python types and numpy arrays (the distances are stored as steps).  Neighboring dendrites, compartments 
+    and points refer to each other by index.  The description is enough to 
+    rebuild the morphology with loadDescription without growing it again.
+    """
+    def describe(self):
+        dendrites = []
+        for dendrite in self.dendrites:
+            dendrites.append([[location.toTuple() for location in dendrite.locations],
+                              [child.index for child in dendrite.children],
+                              dendrite.heading, dendrite.master_branch_ID])
+        
+        compartments = []
+        for compartment in self.compartments:
+            compartments.append([[point.toTuple() for point in compartment.line_points],
+                                 [neighbor.index for neighbor in compartment.proximal_neighbors],
+                                 [neighbor.index for neighbor in compartment.distal_neighbors],
+                                 [location.toTuple() for location in compartment.gridded_locations],
+                                 dict(compartment.neurotransmitters_input_weights),
+                                 dict(compartment.neurotransmitters_output_weights)])
+        
+        # A compartment's points sit on its gridded locations (in order), so 
+        # only the compartment and synapse properties of each point are needed
+        points = []
+        for point in self.points:
+            points.append([point.compartment.index, point.wirelength,
+                           set(point.neurotransmitters_accepted),
+                           set(point.neurotransmitters_released)])
+        
+        description = {}
+        description["dendrites"]            = dendrites
+        description["master_dendrites"]     = [dendrite.index for dendrite in self.master_dendrites]
+        description["compartments"]         = compartments
+        description["master_compartments"]  = [compartment.index for compartment in self.master_compartments]
+        description["points"]               = points
+        description["distance_steps"]       = self.getDistanceSteps()
+        description["diffusion_weights"]    = np.array(self.diffusion_weights)
+        return description
+    
+    """
+    Rebuild the dendrites, compartments and points of a morphology from a
+    description created by describe
+    """
+    def loadDescription(self, description):
+        self.dendrites = []
+        for locations, children, heading, master_branch_ID in description["dendrites"]:
+            dendrite = DendriteSegment(self, Vector2D(*locations[0]), heading, 0.0, 0.0,
+                                       self.children_deviation, self.dendrite_vision_radius,
+                                       master_branch_ID)
+            dendrite.locations  = [Vector2D(x, y) for (x, y) in locations]
+            dendrite.is_growing = False
+            dendrite.registerDendriteWithNeuron()
+        for dendrite, dendrite_description in zip(self.dendrites, description["dendrites"]):
+            dendrite.children = [self.dendrites[i] for i in dendrite_description[1]]
+        self.master_dendrites           = [self.dendrites[i] for i in description["master_dendrites"]]
+        self.number_master_dendrites    = len(self.master_dendrites)
+        self.number_dendrites           = len(self.dendrites)
+        
+        self.compartments = []
+        for compartment_description in description["compartments"]:
+            GrowingCompartment(self)
+        for compartment, compartment_description in zip(self.compartments, description["compartments"]):
+            line_points, proximal, distal, gridded_locations, inputs, outputs = compartment_description
+            compartment.line_points         = [Vector2D(x, y) for (x, y) in line_points]
+            compartment.proximal_neighbors  = [self.compartments[i] for i in proximal]
+            compartment.distal_neighbors    = [self.compartments[i] for i in distal]
+            compartment.gridded_locations   = [Vector2D(x, y) for (x, y) in gridded_locations]
+            compartment.neurotransmitters_input_weights     = dict(inputs)
+            compartment.neurotransmitters_output_weights    = dict(outputs)
+        self.master_compartments = [self.compartments[i] for i in description["master_compartments"]]
+        
+        self.points = []
+        for compartment_index, wirelength, accepted, released in description["points"]:
+            compartment = self.compartments[compartment_index]
+            location    = compartment.gridded_locations[len(compartment.points)]
+            point       = DendritePoint(self.retina, compartment, location, wirelength)
+            point.neurotransmitters_accepted = set(accepted)
+            point.neurotransmitters_released = set(released)
+            compartment.points.append(point)
+        
+        self.setDistancesFromSteps(description["distance_steps"])
+        self.diffusion_weights  = np.array(description["diffusion_weights"])
         
     def grow(self):
         
@@ -113,6 +250,37 @@ class StarburstMorphology(object):
                     if event.type == QUIT: running = False
     
             
+    def getSegmentCell(self, location):
+        return (int(m.floor(location.x / self.segment_cell_size)), 
+                int(m.floor(location.y / self.segment_cell_size)))
+    
+    def registerSegment(self, dendrite, segment_index):
+        radius, center = dendrite.circle_bounds[segment_index]
+        cell = self.getSegmentCell(center)
+        if cell in self.segment_grid:
+            self.segment_grid[cell].append((dendrite, segment_index))
+        else:
+            self.segment_grid[cell] = [(dendrite, segment_index)]
+    
+    """
+    Find the (dendrite, segment index) pairs of the registered line segments
+    whose centers are in the cells that overlap a square of the given radius
+    around a location.  They are sorted into the order of the neuron's 
+    dendrite list (and then segment order), which is the order that the 
+    segments would be found by looping over all of the dendrites.
+    """
+    def findNearbySegments(self, location, radius):
+        min_x, min_y = self.getSegmentCell(location - Vector2D(radius, radius))
+        max_x, max_y = self.getSegmentCell(location + Vector2D(radius, radius))
+        
+        segments = []
+        for x in range(min_x, max_x+1):
+            for y in range(min_y, max_y+1):
+                if (x, y) in self.segment_grid:
+                    segments.extend(self.segment_grid[(x, y)])
+        segments.sort(key=lambda segment: (segment[0].index, segment[1]))
+        return segments
+            
     def colorCompartments(self, palette):
         colors  = palette
         index   = 0
@@ -185,55 +353,107 @@ class StarburstMorphology(object):
             compartment.createPoints(self.location, 0.0)
     
     
+    """
+    Find the path distance between every pair of compartments.  Neighboring
+    compartments are one step_size apart, so a breadth first search from every
+    compartment at once (one sparse product per step) gives the number of 
+    steps between each pair.  The steps are converted to distances by
+    multiplying them by step_size.  Compartments that cannot be reached are an
+    infinite distance apart.
+    """
     def buildLineSegmentShortestPaths(self):
-        distance_adjacency = []
         number_segments = len(self.compartments)
-        for row_num in range(number_segments): 
-            distance_row    = []
-            for element_num in range(number_segments):
-                distance_row.append(0.0)
-            distance_adjacency.append(distance_row)
-            
+        
+        rows = []
+        cols = []
         for compartment in self.compartments:
             for neighbor in compartment.distal_neighbors + compartment.proximal_neighbors:
-                distance_adjacency[compartment.index][neighbor.index] = self.step_size
-                distance_adjacency[neighbor.index][compartment.index] = self.step_size
-                
-        self.distance_adjacency = distance_adjacency
-        self.distance_graph     = Graph.Weighted_Adjacency(distance_adjacency, mode=ADJ_UNDIRECTED)
-        self.distances          = np.array(self.distance_graph.shortest_paths(weights="weight"))
-        
-        for row in range(number_segments):
-            col = row
-            self.distances[row][col] = 0.0
+                rows.extend([compartment.index, neighbor.index])
+                cols.extend([neighbor.index, compartment.index])
+        adjacency = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), 
+                                      shape=(number_segments, number_segments))
+        
+        # Row i of the frontier holds the compartments that are the current
+        # number of steps away from compartment i.  Each step, the frontier's
+        # neighbors that have not been reached yet become the new frontier.
+        steps       = np.zeros((number_segments, number_segments), dtype=int) - 1
+        steps[np.diag_indices(number_segments)] = 0
+        frontier    = sparse.identity(number_segments, format="csr")
+        step        = 0
+        while frontier.nnz > 0:
+            step += 1
+            neighbors   = (frontier * adjacency).tocoo()
+            unreached   = steps[neighbors.row, neighbors.col] < 0
+            rows        = neighbors.row[unreached]
+            cols        = neighbors.col[unreached]
+            steps[rows, cols] = step
+            frontier    = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), 
+                                            shape=(number_segments, number_segments))
+        
+        self.setDistancesFromSteps(steps)
+    
+    """
+    The distances are always a whole number of steps, so they can be stored
+    compactly as the number of steps between compartments (-1 if unreachable)
+    """
+    def setDistancesFromSteps(self, steps):
+        self.distances = steps.astype(float) * self.step_size
+        self.distances[steps < 0] = np.inf
+    
+    def getDistanceSteps(self):
+        steps = np.round(self.distances / self.step_size)
+        steps[np.isinf(self.distances)] = -1
+        return steps.astype(np.int32)
             
+    """
+    Build the (compartments x compartments) diffusion weights with whole-array
+    operations.  Depending on the diffusion method, the weight between i and j
+    starts out as:
+        Gaussian Volume - the total length of the compartments that are no 
+            further from i than j is (passed through a gaussian)
+        Gaussian Distance - the path distance between i and j (passed through
+            a gaussian)
+        Average Everyone - 1
+        Nearest Neighbor Average - 1 if j is within one step of i, else 0
+    Each row is then normalized to sum to 1.
+    """
     def establisthLineSegmentDiffusionWeights(self, diffusion_method="Gaussian Distance"):
         number_segments         = len(self.compartments)
-        self.diffusion_weights  = np.zeros((number_segments, number_segments))
         sigma                   = self.diffusion_width
         
-        np_distances    = np.array(self.distances)
-        np_lengths      = np.array(np.ones((1, number_segments))) * self.step_size
+        np_distances    = np.array(self.distances, dtype=float)
         
-        for row in range(number_segments):
-            for col in range(number_segments):
-                distance = float(self.distances[row][col])
-                volume = 0.0
-                np_distance_row = np_distances[row,:]
-                matching_cols, = np.where(np_distance_row<=distance)
-                volume += np.sum(np_lengths[0, matching_cols])
-                
-                if diffusion_method == "Gaussian Volume":
-                    self.diffusion_weights[row, col] = volume
-                elif diffusion_method == "Gaussian Distance":
-                    self.diffusion_weights[row, col] = distance
-                elif diffusion_method == "Average Everyone":
-                    self.diffusion_weights[row, col] = 1.0
-                elif diffusion_method == "Nearest Neighbor Average":
-                    if distance <= self.step_size: 
-                        self.diffusion_weights[row, col] = 1.0
-                    else: 
-                        self.diffusion_weights[row, col] = 0.0
+        if diffusion_method == "Gaussian Volume":
+            # Sort each row of distances, then for each sorted position find 
+            # the number of compartments whose distance is less than or equal 
+            # to it (the position of the last tied distance plus one)
+            rows            = np.arange(number_segments).reshape(-1, 1)
+            order           = np.argsort(np_distances, 1, kind="mergesort")
+            sorted_rows     = np_distances[rows, order]
+            
+            group_ends              = np.ones((number_segments, number_segments), dtype=bool)
+            group_ends[:, :-1]      = sorted_rows[:, 1:] != sorted_rows[:, :-1]
+            end_positions           = np.where(group_ends, np.arange(number_segments), number_segments)
+            sorted_counts           = np.minimum.accumulate(end_positions[:, ::-1], 1)[:, ::-1] + 1
+            counts                  = np.zeros((number_segments, number_segments), dtype=int)
+            counts[rows, order]     = sorted_counts
+            
+            # All compartments are step_size long, so the volume only depends 
+            # on the count.  Summing the lengths like this (instead of taking
+            # count * step_size) gives exactly the same floating point values 
+            # as summing the lengths of the matching compartments.
+            volumes = np.zeros(number_segments + 1)
+            for count in range(1, number_segments + 1):
+                volumes[count] = np.sum(np.ones(count) * self.step_size)
+            self.diffusion_weights = volumes[counts]
+        elif diffusion_method == "Gaussian Distance":
+            self.diffusion_weights = np_distances.copy()
+        elif diffusion_method == "Average Everyone":
+            self.diffusion_weights = np.ones((number_segments, number_segments))
+        elif diffusion_method == "Nearest Neighbor Average":
+            self.diffusion_weights = (np_distances <= self.step_size).astype(float)
+        else:
+            self.diffusion_weights = np.zeros((number_segments, number_segments))
         
         if (diffusion_method == "Gaussian Volume") or (diffusion_method == "Gaussian Distance"): 
             self.diffusion_weights = np.exp(-self.diffusion_weights**2.0/(2.0*sigma**2.0))
@@ -300,17 +520,47 @@ class StarburstMorphology(object):
         old_location = self.location
         self.location = new_location   
         
+        colors = getColormapLUT(colormap).getColors(activities[0]).tolist()
         for compartment_index in range(len(self.compartments)):
             compartment = self.compartments[compartment_index]
-            activity    = activities[0, compartment_index]
-            color       = getColorFromActivity(colormap, activity)         
-            compartment.draw(surface, scale=scale, color=color, draw_text=False)
+            compartment.draw(surface, scale=scale, color=colors[compartment_index], draw_text=False)
                 
         # Shift the cell's location back to the original
         self.location = old_location 
 
 
 
+"""
+Stand-in for the Retina when a morphology is grown in a worker process.  Growing
+a morphology only needs the retina's grid size, while the full retina (with its
+layers and pygame stimulus) is expensive or impossible to pickle.
+"""
+class MorphologyGrowthRetina(object):
+    def __init__(self, grid_size):
+        self.grid_size = grid_size
+
+"""
+Grow a morphology and return its compact description.  This is the function run
+by the worker processes of a multiprocessing Pool, so it takes a single tuple:
+    (grid_size, morphology arguments dictionary, random seed, morphology library)
+The morphology library may be None.
+"""
+def growMorphologyDescription(arguments):
+    grid_size, parameters, random_seed, morphology_library = arguments
+    morphology = StarburstMorphology(MorphologyGrowthRetina(grid_size), random_seed=random_seed,
+                                     morphology_library=morphology_library, **parameters)
+    return morphology.describe()
+
+"""
+Run when each worker process of a morphology growth Pool starts.  The workers 
+are forked from a process that may have initialized pygame, and SDL replaces
+the SIGTERM handler, which would keep the pool from terminating its workers.
+"""
+def initializeGrowthWorker():
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+
 # .............................................................................
 # Old functions that may not be used?
 # .............................................................................
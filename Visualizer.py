@@ -145,24 +145,31 @@ class Visualizer:
         self.on_bipolar_layer   = r.on_bipolar_layer
         self.off_bipolar_layer  = r.off_bipolar_layer
         
-        print "Cone Activities"
-        self.cone_activities = r.cone_activities
-        self.cone_activity_bounds = self.findActivityBounds(self.cone_activities, -1, 1, True)
-        
-        print "Horizontal Activities"
-        self.horizontal_activities = r.horizontal_activities
-        self.horizontal_activity_bounds = self.findActivityBounds(self.horizontal_activities, -1, 1, True)
-        
-        print "On Bipolar Activities"
-        self.on_bipolar_activities = r.on_bipolar_activities
-        self.on_bipolar_activity_bounds = self.findActivityBounds(self.cone_activities, -1, 1, True)
-        
-        print "Off Bipolar Activities"
-        self.off_bipolar_activities = r.off_bipolar_activities
-        self.off_bipolar_activity_bounds = self.findActivityBounds(self.cone_activities, -1, 1, True)
+        self.cone_activities, self.cone_activity_bounds                 = self.loadLayerActivities("Cone")
+        self.horizontal_activities, self.horizontal_activity_bounds     = self.loadLayerActivities("Horizontal")
+        self.on_bipolar_activities, self.on_bipolar_activity_bounds     = self.loadLayerActivities("On Bipolar")
+        self.off_bipolar_activities, self.off_bipolar_activity_bounds   = self.loadLayerActivities("Off Bipolar")
         
         self.timestep       = 0
-        self.end_timestep   = len(self.cone_activities) - 1
+        self.end_timestep   = max(len(self.cone_activities) - 1, 0)
+    
+    """
+    Get the activities of a layer and the bounds of its color scale.  The
+    activities are not copied - they may be a memory-map of recorded or saved
+    activities, in which case only the timesteps that are played are read.  The
+    bounds that the retina found when it was run (or that were saved with it)
+    are used when they are available so the activities do not need to be
+    searched.
+    """
+    def loadLayerActivities(self, layer_name):
+        layer_index = self.retina.layer_names.index(layer_name)
+        activities  = self.retina.getLayerActivities(layer_index)
+        bounds      = self.retina.activity_bounds[layer_index]
+        if activities is None: activities = []
+        if bounds == []:
+            if len(activities) > 0: bounds = self.findActivityBounds(activities, -1, 1, True)
+            else:                   bounds = [-1.0, 1.0]
+        return activities, bounds
     
     
     
@@ -313,10 +320,14 @@ class Visualizer:
     def playLayerActivity(self, surface, activities, locations, radius,
                           min_activity, max_activity, activity_centered_on_zero=True):
                              
-        number_neurons = activities[0].shape[1]
+        if self.timestep >= len(activities): return
+        
+        # Only read the current timestep's activities
+        activity_row    = np.asarray(activities[self.timestep])[0]
+        number_neurons  = len(activity_row)
         for n in range(number_neurons):
             x, y        = locations[n]
-            activity    = activities[self.timestep][0,n]
+            activity    = activity_row[n]
             color       = self.mapActivityToColor(activity, min_activity, max_activity, 
                                                   activity_centered_on_zero)
             pygame.draw.circle(surface, color, (x,y), radius) 